@@ -1,12 +1,20 @@
 from .anno_check import anno_check
-from .get_cell_coords import get_cell_coords
+from .get_cell_coords import get_cell_coords, iter_cell_coords
 from .get_cell_den import get_cell_den
 
 # from .get_cells import get_cells
 from .get_clin import get_clin
 from .plot_cells import plot_cells
-from .roc_plotter import auc_grabber, threshold_grabber, roc_plotter
+from .roc_plotter import (
+    auc_grabber,
+    threshold_grabber,
+    roc_plotter,
+    bootstrap_roc,
+    batch_roc,
+)
 from .cox_plot import cox_plot
+from .cox_screen import cox_screen
+from .cutpoint import logrank_cutpoint
 from .archived.histogrammer import histogrammer
 from .hist_plotter import hist_plotter
 from .scatterplotter import scatterPlotter
@@ -15,3 +23,19 @@ from .dynamic_query import dynamic_sql
 from .expr_total import expr_total
 from .get_cell_counts import get_cell_counts
 from .tdist_ogram import tdistogram
+from .db_session import DBPool, get_db, close_sessions
+from .query_cache import enable_cache, disable_cache, invalidate_cache
+from .snapshot import snapshot_cohort, read_snapshot
+from .filter_spec import FilterSpec
+from .get_density import get_density
+from .compact import compact_frame
+from .membership import get_anno_geoms, tag_membership, membership_mask
+from .geom_cache import (
+    get_geometries,
+    tdist_band,
+    tdist_ring,
+    clear_geom_cache,
+)
+from .hist_cube import HistCube, build_cube
+from .smoothing import smooth_groups
+from .tdist_plan import TdistPlan, tdist_plan
@@ -1,3 +1,6 @@
+from .query_cache import cached_query
+
+
 # Check which cases is in the current db have certain annotations
 def anno_check(annos_to_check, database, shortcut=None):
 
@@ -13,6 +16,8 @@ def anno_check(annos_to_check, database, shortcut=None):
     where lname in ({",".join([f"'{x}'" for x in annos_to_check])})
     """
 
-    samples = database.query(sql)["sampleid"].to_list()
+    # Repeat calls are served by the query cache when it is enabled, and
+    # dropped along with it by invalidate_cache
+    samples = cached_query(database, sql, altdb=shortcut)["sampleid"].to_list()
 
     return samples
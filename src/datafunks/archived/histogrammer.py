@@ -1,6 +1,6 @@
 import pandas as pd
 import numpy as np
-from astropathdb import AstroDB
+from ..db_session import get_db, db_name
 
 
 def histogrammer(
@@ -48,9 +48,9 @@ def histogrammer(
     else:
         ln_sql = ""
 
-    print(f"Querying {database}, binning {pheno} by {anno_col}.")
+    print(f"Querying {db_name(database)}, binning {pheno} by {anno_col}.")
 
-    db = AstroDB(database=database)
+    db = get_db(database)
 
     sql = f"""
     select ct.sampleid, p.phenotype, ct.exprphenotype,
@@ -0,0 +1,40 @@
+"""Shrink query results to a compact, typed schema."""
+
+import numpy as np
+import pandas as pd
+
+CATEGORY_COLS = ["phenotype", "exprphenotype", "lname", "filters"]
+INT32_COLS = ["sampleid", "tdist_bin", "c"]
+FLOAT32_COLS = ["px", "py"]
+
+
+def compact_frame(df):
+    """Convert known columns of a query result to compact dtypes, in place:
+    categorical phenotype/exprphenotype labels, int32 sampleid/tdist_bin/c
+    and float32 px/py. Columns that don't fit (e.g. NaNs in an int column,
+    fractional tdist bins) are left as they are.
+    df: DataFrame
+    """
+
+    for col in CATEGORY_COLS:
+        if col in df.columns and (
+            df[col].dtype == object or pd.api.types.is_string_dtype(df[col])
+        ):
+            df[col] = df[col].astype("category")
+
+    for col in INT32_COLS:
+        if col not in df.columns or not pd.api.types.is_numeric_dtype(df[col]):
+            continue
+        values = df[col].to_numpy()
+        if np.isnan(values.astype(float)).any():
+            continue
+        if (np.round(values) == values).all() and (
+            np.abs(values).max(initial=0) < np.iinfo(np.int32).max
+        ):
+            df[col] = values.astype(np.int32)
+
+    for col in FLOAT32_COLS:
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].astype(np.float32)
+
+    return df
@@ -1,9 +1,9 @@
 """Consistently create forest plot for any number of covariates."""
 
-import pandas as pd
 from lifelines import CoxPHFitter
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import FontProperties
+from .cox_screen import cox_screen
 
 
 def cox_plot(
@@ -15,8 +15,12 @@ def cox_plot(
     y_min=-0.5,
     multivariable=True,
     cohort_label="None",
+    n_jobs=1,
 ):
-    """Consistently create forest plot for any number of covariates."""
+    """Consistently create forest plot for any number of covariates.
+    n_jobs: processes for the univariable fits (multivariable=False),
+        defaults to 1; see cox_screen, which fits without plotting
+    """
 
     if not isinstance(variable_cols, list) and variable_cols is not None:
         variable_cols = [variable_cols]
@@ -37,25 +41,15 @@ def cox_plot(
     else:
         multi = ""
         cap_height = 1 / 48
-        # Perform CoxPH per variable
-        res_list = []
-        y_labels = []
-        for idx, var in enumerate(variable_cols):
-            # Drop irrelevant columns and any Nan vals
-            data = cohort[
-                ~cohort[[var, outcome_col, event_col]].isna().any(axis=1)
-            ][[var, outcome_col, event_col]]
-            cph = CoxPHFitter()
-            cph.fit(df=data, duration_col=outcome_col, event_col=event_col)
-
-            res = cph.summary
-
-            res_list.append(res)
-
-            y_labels.append(var)
+        # Fit every variable first, then plot
+        res = cox_screen(
+            cohort, variable_cols, outcome_col, event_col, n_jobs=n_jobs
+        )
+        y_labels = list(res.index)
 
+        for idx, (_, row) in enumerate(res.iterrows()):
             plt.scatter(
-                x=res["exp(coef)"].iloc[0],
+                x=row["exp(coef)"],
                 y=idx,
                 marker="s",
                 color="white",
@@ -74,30 +68,28 @@ def cox_plot(
 
             plt.axhline(
                 y=idx,
-                xmin=res["exp(coef) lower 95%"].iloc[0] / x_lim,
-                xmax=res["exp(coef) upper 95%"].iloc[0] / x_lim,
+                xmin=row["exp(coef) lower 95%"] / x_lim,
+                xmax=row["exp(coef) upper 95%"] / x_lim,
                 color="black",
                 zorder=1,
             )
 
             # Plot end caps for CI bars
             plt.axvline(
-                x=res["exp(coef) lower 95%"].iloc[0],
+                x=row["exp(coef) lower 95%"],
                 ymin=(idx - y_min - cap_height) / len(variable_cols),
                 ymax=(idx - y_min + cap_height) / len(variable_cols),
                 color="black",
                 zorder=1,
             )
             plt.axvline(
-                x=res["exp(coef) upper 95%"].iloc[0],
+                x=row["exp(coef) upper 95%"],
                 ymin=(idx - y_min - cap_height) / len(variable_cols),
                 ymax=(idx - y_min + cap_height) / len(variable_cols),
                 color="black",
                 zorder=1,
             )
 
-        res = pd.concat(res_list)
-
         plt.gca().set_yticks([*range(len(variable_cols))], y_labels)
         plt.xlabel("HR (95% CI)")
 
@@ -0,0 +1,120 @@
+"""Univariable Cox models for many covariates, fit in parallel."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from lifelines import CoxPHFitter
+from lifelines.exceptions import ConvergenceError
+from statsmodels.stats.multitest import multipletests
+
+COLS = [
+    "coef",
+    "se(coef)",
+    "exp(coef)",
+    "exp(coef) lower 95%",
+    "exp(coef) upper 95%",
+    "p",
+    "concordance",
+    "n",
+    "events",
+]
+
+
+def _fit_chunk(args):
+    # Fit each covariate of a chunk against the shared duration/event arrays
+    names, x, duration, event = args
+
+    rows = []
+    for col in x.T:
+        keep = ~np.isnan(col)
+        # Fixed column names, so a covariate called e.g. duration can't
+        # overwrite the outcome
+        data = pd.DataFrame(
+            {
+                "_x": col[keep],
+                "_duration": duration[keep],
+                "_event": event[keep],
+            }
+        )
+        row = dict.fromkeys(COLS, np.nan)
+        row["n"] = int(keep.sum())
+        row["events"] = int(event[keep].sum())
+        try:
+            cph = CoxPHFitter()
+            cph.fit(df=data, duration_col="_duration", event_col="_event")
+        except (ConvergenceError, ValueError, np.linalg.LinAlgError):
+            # e.g. a constant covariate; leave the row empty
+            rows.append(row)
+            continue
+
+        summary = cph.summary.iloc[0]
+        row.update({col: summary[col] for col in COLS[:6]})
+        row["concordance"] = cph.concordance_index_
+        rows.append(row)
+
+    return names, rows
+
+
+def cox_screen(
+    cohort=None,
+    variable_cols=None,
+    outcome_col=None,
+    event_col=None,
+    n_jobs=1,
+    chunk_size=10,
+):
+    """Fit one univariable CoxPH model per covariate.
+    cohort: DataFrame
+    variable_cols: covariate column(s)
+    outcome_col: duration column
+    event_col: event column
+    n_jobs: processes, defaults to 1 (serial); None uses all cores
+    chunk_size: covariates per task, defaults to 10
+    Rows with NaN duration/event are dropped once; NaN covariate values are
+    dropped per fit. Returns lifelines' summary columns (coef, exp(coef),
+    95% CI, p) with concordance, n, events and Benjamini-Hochberg fdr, one
+    row per covariate. Covariates that fail to fit get NaNs.
+    """
+
+    if not isinstance(variable_cols, list) and variable_cols is not None:
+        variable_cols = [variable_cols]
+
+    # Drop NaN duration/event rows once; every fit shares these arrays
+    cohort = cohort[cohort[[outcome_col, event_col]].notna().all(axis=1)]
+    duration = cohort[outcome_col].to_numpy(dtype=float)
+    event = cohort[event_col].to_numpy(dtype=float)
+    x = cohort[variable_cols].to_numpy(dtype=float)
+
+    tasks = []
+    for start in range(0, len(variable_cols), chunk_size):
+        stop = start + chunk_size
+        tasks.append(
+            (variable_cols[start:stop], x[:, start:stop], duration, event)
+        )
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_fit_chunk, tasks))
+    else:
+        results = [_fit_chunk(task) for task in tasks]
+
+    res = pd.DataFrame(
+        [row for _, rows in results for row in rows],
+        index=pd.Index(
+            [name for names, _ in results for name in names], name="covariate"
+        ),
+        columns=COLS,
+    )
+
+    # False discovery rate over the covariates that fit
+    res["fdr"] = np.nan
+    fitted = res["p"].notna()
+    if fitted.any():
+        res.loc[fitted, "fdr"] = multipletests(
+            res.loc[fitted, "p"], method="fdr_bh"
+        )[1]
+
+    return res
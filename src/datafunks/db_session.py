@@ -0,0 +1,159 @@
+"""Process-wide registry of pooled AstroDB sessions keyed by database name."""
+
+import threading
+import time
+from astropathdb import AstroDB
+
+# Connections idle for longer than this (seconds) are dropped from the pool
+MAX_IDLE = 600
+# Connections idle for longer than this (seconds) are pinged before reuse
+CHECK_AFTER = 60
+# Maximum number of idle connections kept per database
+POOL_SIZE = 4
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+class DBPool:
+    """Pool of warm AstroDB connections to a single database.
+    Exposes .query(sql) like AstroDB so it can be passed anywhere an AstroDB
+    object is accepted. Each query borrows an idle connection (pinging it
+    first if it has sat unused for a while) and returns it afterwards.
+    database: database name, e.g. 'wsi02'
+    pool_size: maximum number of idle connections to keep
+    max_idle: seconds before an idle connection is evicted
+    check_after: seconds idle before a connection is health-checked
+    """
+
+    def __init__(
+        self,
+        database,
+        pool_size=POOL_SIZE,
+        max_idle=MAX_IDLE,
+        check_after=CHECK_AFTER,
+    ):
+        self.database = database
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self._idle = []  # (last_used, connection), most recent last
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"DBPool(database={self.database!r}, idle={len(self._idle)})"
+
+    def _connect(self):
+        return AstroDB(database=self.database)
+
+    @staticmethod
+    def _close(conn):
+        close = getattr(conn, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+    @staticmethod
+    def _healthy(conn):
+        try:
+            conn.query("select 1 ok")
+        except Exception:  # pylint: disable=broad-except
+            return False
+        return True
+
+    def evict_idle(self):
+        """Drop connections that have been idle for longer than max_idle."""
+        cutoff = time.monotonic() - self.max_idle
+        with self._lock:
+            stale = [conn for used, conn in self._idle if used < cutoff]
+            self._idle = [(u, c) for u, c in self._idle if u >= cutoff]
+        for conn in stale:
+            self._close(conn)
+
+    def acquire(self):
+        """Borrow a healthy connection, opening a new one if none are idle."""
+        self.evict_idle()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                used, conn = self._idle.pop()
+            if time.monotonic() - used < self.check_after or self._healthy(
+                conn
+            ):
+                return conn
+            self._close(conn)
+
+        return self._connect()
+
+    def release(self, conn):
+        """Return a borrowed connection to the pool."""
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((time.monotonic(), conn))
+                return
+        self._close(conn)
+
+    def query(self, sql):
+        """Run sql on a pooled connection and return the result DataFrame."""
+        conn = self.acquire()
+        try:
+            result = conn.query(sql)
+        except Exception:
+            # Don't hand a possibly broken connection to the next caller
+            self._close(conn)
+            raise
+        self.release(conn)
+
+        return result
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, conn in idle:
+            self._close(conn)
+
+
+def get_db(database="wsi02"):
+    """Get a pooled session for a database.
+    database: database name, or an existing DBPool/AstroDB object which is
+        returned unchanged
+    """
+
+    if not isinstance(database, str):
+        return database
+
+    with _SESSIONS_LOCK:
+        if database not in _SESSIONS:
+            _SESSIONS[database] = DBPool(database)
+        return _SESSIONS[database]
+
+
+def db_name(database):
+    """Name of the database behind a name, DBPool or AstroDB object.
+    Returns None when it cannot be determined.
+    """
+
+    if isinstance(database, str):
+        return database
+
+    return getattr(database, "database", None)
+
+
+def close_sessions(database=None):
+    """Close pooled sessions.
+    database: name of the database to close, defaults to all
+    """
+
+    with _SESSIONS_LOCK:
+        if database is None:
+            pools = list(_SESSIONS.values())
+            _SESSIONS.clear()
+        else:
+            pools = [_SESSIONS.pop(database)] if database in _SESSIONS else []
+
+    for pool in pools:
+        pool.close()
@@ -1,3 +1,6 @@
+from .filter_spec import FilterSpec, inline_params
+
+
 def dynamic_sql(
     phenos=None,
     tdist_filter=None,
@@ -8,6 +11,8 @@ def dynamic_sql(
     t_hist_type=None,
 ):
     """This saves some tedious repition in sql queries for common tasks.
+    Kept for old notebooks; new queries should compile a FilterSpec, which
+    keeps values as parameters instead of inlining them.
     pheno: str or list. defaults to all
     tdist_filter: (outer, inner) bounds in microns; outer bound if not tuple
     rdist_filter: (outer, inner) bounds in microns; outer bound if not tuple
@@ -15,100 +20,39 @@ def dynamic_sql(
     excl_ln: defaults to False
     t_hist_step: defaults to 50 micron bins. Setting to None gets all cells
     t_hist_type: input I was workshopping to accommodate percent distance bins
+    An inner-only bound, e.g. (None, 100), is applied as tdist > 100; it used
+    to be dropped.
     """
 
-    # Translate function inputs into SQL snippets to sub into full query
-    # ========================================================================
-    if (t_hist_step is not None) & (t_hist_type != "fractional reg"):
-        # convert to pixels
-        t_hist_step = t_hist_step * 2
-
-    # Phenotype filter
-    if phenos is not None:
-        if isinstance(phenos, str):
-            phenos = [phenos]
-        pheno_sql = f"""
-        and p.phenotype in ({",".join([f"'{x}'" for x in phenos])})
-        """
-    else:
-        pheno_sql = ""
-
-    if all_reg:
-        # Dynamic tdist filtering with all regression
-        if (tdist_filter[0] is not None) and (tdist_filter[1] is not None):
-            tdist_sql = f"""
-            and ((tdist <= {tdist_filter[0]} and tdist > {tdist_filter[1]})
-                or rdist <= 0)
-            """
-        elif tdist_filter[0] is not None:
-            tdist_sql = f"""
-            and (tdist <= {tdist_filter[0]} or rdist <= 0)
-            """
-        elif tdist_filter[0] is not None:
-            tdist_sql = f"""
-            and (tdist > {tdist_filter[1]} or rdist <= 0)
-            """
-        else:
-            tdist_sql = ""
+    spec = FilterSpec(
+        phenos=phenos,
+        tdist_filter=tdist_filter,
+        rdist_filter=rdist_filter,
+        all_reg=all_reg,
+        excl_ln=excl_ln,
+        t_hist_step=t_hist_step,
+        t_hist_type=t_hist_type,
+    )
+    # Bare tdist/rdist columns, so old queries needn't alias celltag as c
+    compiled = spec.compile(qualify=False)
 
-    else:
-        # Dynamic tdist filtering without all regression
-        if (tdist_filter[0] is not None) and (tdist_filter[1] is not None):
-            tdist_sql = f"""
-            and (tdist <= {tdist_filter[0]} and tdist > {tdist_filter[1]})
-            """
-        elif tdist_filter[0] is not None:
-            tdist_sql = f"""
-            and tdist <= {tdist_filter[0]}
-            """
-        elif tdist_filter[0] is not None:
-            tdist_sql = f"""
-            and tdist > {tdist_filter[1]}
-            """
+    # Translate function inputs into SQL snippets to sub into full query
+    snippets = []
+    for name in ["pheno", "tdist", "rdist", "ln"]:
+        clause = compiled.clauses.get(name)
+        if clause is None:
+            snippets.append("")
         else:
-            tdist_sql = ""
-
-    # Dynamic rdist filtering
-    if (rdist_filter[0] is not None) and (rdist_filter[1] is not None):
-        rdist_sql = f"""
-        and (rdist <= {rdist_filter[0]} and rdist > {rdist_filter[1]})
-        """
-    elif rdist_filter[0] is not None:
-        rdist_sql = f"""
-        and rdist <= {rdist_filter[0]}
-        """
-    elif rdist_filter[0] is not None:
-        rdist_sql = f"""
-        and rdist > {rdist_filter[1]}
-        """
-    else:
-        rdist_sql = ""
-
-    # Exclude lymph node
-    if excl_ln:
-        ln_sql = "and (ln.lname is NULL or ln.ganno.STContains(c.pos) = 0)"
-    else:
-        ln_sql = ""
+            snippets.append(f"and {inline_params(clause, compiled.params)}")
 
-    # Bin tdist to create histogram of areas, convert tdist to um
-    if t_hist_type == "fractional reg":
-        t_hist_sql = f"""
-        floor((tdist2/(tdist2 - rdist2))*100/
-        {t_hist_step})*{t_hist_step} tdist_bin,
-        """
-        group_sql = f"""
-                     , floor((tdist2/(tdist2 - rdist2))*100/
-                     {t_hist_step})*{t_hist_step}
-                    """
-    elif t_hist_step is not None:
-        t_hist_sql = f"""
-        floor(tdist/{t_hist_step})*{t_hist_step}/2 tdist_bin,
-        """
-        group_sql = f""", floor(tdist/{t_hist_step})*{t_hist_step}/2"""
+    if compiled.bin_expr:
+        bin_expr = inline_params(compiled.bin_expr, compiled.params)
+        t_hist_sql = f"{bin_expr} tdist_bin,"
+        group_sql = f", {bin_expr}"
     else:
         t_hist_sql = ""
         group_sql = ""
 
-    # ======================================================================
+    pheno_sql, tdist_sql, rdist_sql, ln_sql = snippets
 
     return pheno_sql, tdist_sql, rdist_sql, ln_sql, t_hist_sql, group_sql
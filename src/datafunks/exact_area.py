@@ -0,0 +1,139 @@
+"""Exact tissue area per tdist bin, measured on the annotation polygons
+instead of counting randomcell rows."""
+
+import pandas as pd
+import shapely
+from .geom_cache import get_geometries, tdist_band
+
+# Square pixels (0.5 micron) to square mm
+PX2_TO_MM2 = 0.25e-6
+
+LNAMES = ["good tissue", "tumor", "regression", "lymph node"]
+
+
+def _region(geoms, spec):
+    # tissue_region on one sample's {lname: geometry}
+    good = geoms["good tissue"]
+    if good is None:
+        return None
+    reg = geoms["regression"]
+
+    region = tdist_band(good, geoms["tumor"], *spec.tdist_filter)
+    if spec.all_reg and reg is not None:
+        region = shapely.union(region, shapely.intersection(reg, good))
+
+    # rdist is undefined without a regression annotation
+    outer, inner = spec.rdist_filter
+    if outer is not None or inner is not None:
+        if reg is None:
+            return shapely.Polygon()
+        if outer is not None:
+            band = shapely.buffer(reg, outer) if outer else reg
+            region = shapely.intersection(region, band)
+        if inner is not None:
+            band = shapely.buffer(reg, inner) if inner else reg
+            region = shapely.difference(region, band)
+
+    if spec.excl_ln and geoms["lymph node"] is not None:
+        region = shapely.difference(region, geoms["lymph node"])
+
+    if spec.reg_only:
+        region = shapely.Polygon() if reg is None else region & reg
+
+    return region
+
+
+def tissue_region(sampleid, spec, database="wsi02", altdb=None):
+    """Good tissue passing a FilterSpec's tdist, rdist, regression and lymph
+    node filters, as a single geometry. Follows the SQL filters: tdist and
+    rdist bounds are in the same units as the tdist/rdist columns, the inner
+    tdist bound is exclusive, and all_reg keeps regression via rdist <= 0.
+    sampleid: int
+    spec: FilterSpec
+    database: database name or pooled session from get_db
+    altdb: for referencing datatbases not directly accessible (e.g. wsi14)
+    Returns None if the sample has no good tissue
+    """
+
+    geoms = get_geometries(sampleid, LNAMES, database, altdb)
+
+    return _region({ln: geoms[ln][int(sampleid)] for ln in LNAMES}, spec)
+
+
+def exact_area(spec, database="wsi02", altdb=None):
+    """Tissue area of each sample (and tdist bin) from the annotations, in the
+    same shape as get_area: sampleid, [tdist_bin,] area_mm. A bin b covers
+    tdist in [2b, 2(b + step)) pixels, i.e. the tumor buffer ring between
+    those distances, negative (eroded) inside the tumor.
+    spec: FilterSpec with sampleid set
+    database: database name or pooled session from get_db
+    altdb: for referencing datatbases not directly accessible (e.g. wsi14)
+    """
+
+    if spec.t_hist_type == "fractional reg":
+        raise ValueError(
+            "Fractional reg bins can't be measured exactly; use randomcell."
+        )
+
+    binned = spec.t_hist_step is not None
+    # Bins beyond the tdist band are empty, unless regression is kept anyway
+    outer, inner = (None, None) if spec.all_reg else spec.tdist_filter
+
+    # Every polygon of the cohort, uncached ones fetched in one query
+    cohort = get_geometries(spec.sampleid, LNAMES, database, altdb)
+
+    rows = []
+    for s in spec.sampleid:
+        geoms = {ln: cohort[ln][s] for ln in LNAMES}
+        tumor = geoms["tumor"]
+        if tumor is None:
+            if binned or spec.tdist_filter != (None, None):
+                print(f"No tumor annotation for {s}, skipping.")
+                continue
+
+        region = _region(geoms, spec)
+        if region is None or region.is_empty:
+            continue
+
+        if not binned:
+            rows.append((s, region.area * PX2_TO_MM2))
+            continue
+
+        step = spec.t_hist_step
+        # Out from the tumor until the tissue is covered, each ring the
+        # region within one buffer and beyond the last...
+        k = 0
+        lo = tumor
+        while outer is None or 2 * k * step < outer:
+            if shapely.difference(region, lo).is_empty:
+                break
+            hi = shapely.buffer(tumor, 2 * (k + 1) * step)
+            ring = shapely.difference(shapely.intersection(region, hi), lo)
+            rows.append((s, k * step, ring.area * PX2_TO_MM2))
+            lo = hi
+            k += 1
+
+        # ...then in from the boundary until the tumor is eroded away
+        k = -1
+        hi = tumor
+        while inner is None or 2 * (k + 1) * step > inner:
+            if hi.is_empty:
+                break
+            lo = shapely.buffer(tumor, 2 * k * step)
+            ring = shapely.difference(shapely.intersection(region, hi), lo)
+            rows.append((s, k * step, ring.area * PX2_TO_MM2))
+            hi = lo
+            k -= 1
+
+    if binned:
+        area = pd.DataFrame(rows, columns=["sampleid", "tdist_bin", "area_mm"])
+        # Whole bins stay int, like the randomcell and cell count bins
+        if float(spec.t_hist_step).is_integer():
+            area["tdist_bin"] = area["tdist_bin"].astype(int)
+        area = area[area["area_mm"] > 0]
+        area = area.sort_values(["sampleid", "tdist_bin"])
+    else:
+        area = pd.DataFrame(rows, columns=["sampleid", "area_mm"])
+        area = area.sort_values("sampleid")
+
+    return area.reset_index(drop=True)
@@ -0,0 +1,251 @@
+"""Hashable filter spec shared by the celltag/randomcell query funks.
+Compiles to parameterized SQL run through sp_executesql, so SQL Server reuses
+one cached plan per query shape instead of compiling a new plan for every
+sampleid list and tdist bound. Lists are passed as comma-separated strings
+and split with string_split, which needs SQL Server 2016+ (database
+compatibility level 130 or higher).
+"""
+
+import re
+from collections import namedtuple
+from dataclasses import dataclass, replace
+
+import numpy as np
+
+# where: full where clause, clauses: the individual conditions by name,
+# bin_expr/bin_apply/bin_select/bin_group: tdist_bin snippets (empty strings
+# when not binning), params: {name: value} for sp_executesql
+CompiledFilter = namedtuple(
+    "CompiledFilter",
+    [
+        "where",
+        "clauses",
+        "bin_expr",
+        "bin_apply",
+        "bin_select",
+        "bin_group",
+        "params",
+    ],
+)
+
+
+def _as_tuple(x, cast=None):
+    if x is None:
+        return None
+    if isinstance(x, str) or np.isscalar(x):
+        x = [x]
+    if cast is not None:
+        x = [cast(i) for i in x]
+
+    return tuple(sorted(set(x)))
+
+
+def _as_step(x):
+    # Whole steps stay int so tdist_bin keeps T-SQL integer division
+    x = float(x)
+
+    return int(x) if x.is_integer() else x
+
+
+def _as_bounds(x):
+    if not isinstance(x, tuple):
+        # outer, then inner bounds
+        x = (x, None)
+
+    return tuple(None if b is None else float(b) for b in x)
+
+
+def sampleid_in(column):
+    """Condition that column is one of the @sampleids param's sampleids.
+    An empty @sampleids matches no rows.
+    """
+
+    return (
+        f"{column} in (select cast(value as int) "
+        "from string_split(@sampleids, ',') where value <> '')"
+    )
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    """Filters for celltag/randomcell queries. Lists are stored as sorted
+    tuples so equal filters hash equal, e.g. as cache keys.
+    sampleid: int or list. None for no sampleid filter
+    phenos: str or list. None for all
+    tdist_filter: (outer, inner) bounds; outer bound if not tuple
+    rdist_filter: (outer, inner) bounds; outer bound if not tuple
+    all_reg: keep all regression regardless of tdist_filter
+    excl_ln: exclude lymph node
+    reg_only: keep only regression
+    t_hist_step: tdist bin width in microns. None for no binning
+    t_hist_type: input I was workshopping to accommodate percent distance bins
+    """
+
+    sampleid: tuple = None
+    phenos: tuple = None
+    tdist_filter: tuple = (None, None)
+    rdist_filter: tuple = (None, None)
+    all_reg: bool = False
+    excl_ln: bool = False
+    reg_only: bool = False
+    t_hist_step: float = None
+    t_hist_type: str = None
+
+    def __post_init__(self):
+        object.__setattr__(self, "sampleid", _as_tuple(self.sampleid, int))
+        object.__setattr__(self, "phenos", _as_tuple(self.phenos, str))
+        object.__setattr__(self, "tdist_filter", _as_bounds(self.tdist_filter))
+        object.__setattr__(self, "rdist_filter", _as_bounds(self.rdist_filter))
+
+    def replace(self, **changes):
+        """Copy of the spec with some fields changed."""
+        return replace(self, **changes)
+
+    def compile(
+        self,
+        cell="c",
+        reg="r",
+        ln="ln",
+        pheno="p",
+        inclusive=False,
+        spatial_reg=False,
+        qualify=True,
+    ):
+        """Compile to parameterized SQL snippets.
+        cell, reg, ln, pheno: table aliases used by the query; pheno=None
+            skips the phenotype filter (e.g. for randomcell)
+        inclusive: inner tdist bound is inclusive (>=) rather than >
+        spatial_reg: test regression membership with STContains on the
+            regression annotation rather than rdist <= 0
+        qualify: prefix the sampleid and distance columns with the cell alias;
+            False leaves them bare, as in the dynamic_sql snippets
+        """
+
+        clauses = {}
+        params = {}
+        col = f"{cell}." if qualify else ""
+
+        if self.sampleid is not None:
+            clauses["sampleid"] = sampleid_in(f"{col}sampleid")
+            params["sampleids"] = ",".join(map(str, self.sampleid))
+
+        if self.phenos is not None and pheno is not None:
+            clauses["pheno"] = (
+                f"{pheno}.phenotype in "
+                "(select value from string_split(@phenos, ','))"
+            )
+            params["phenos"] = ",".join(self.phenos)
+
+        # Tdist band, optionally keeping all regression
+        outer, inner = self.tdist_filter
+        band = []
+        if outer is not None:
+            band.append(f"{col}tdist <= @tdist_outer")
+            params["tdist_outer"] = outer
+        if inner is not None:
+            op = ">=" if inclusive else ">"
+            band.append(f"{col}tdist {op} @tdist_inner")
+            params["tdist_inner"] = inner
+        if band:
+            band = " and ".join(band)
+            if self.all_reg:
+                if spatial_reg:
+                    in_reg = (
+                        f"({reg}.lname is not NULL "
+                        f"and {reg}.ganno.STContains({cell}.pos) = 1)"
+                    )
+                else:
+                    in_reg = f"{col}rdist <= 0"
+                clauses["tdist"] = f"(({band}) or {in_reg})"
+            else:
+                clauses["tdist"] = f"({band})"
+
+        outer, inner = self.rdist_filter
+        band = []
+        if outer is not None:
+            band.append(f"{col}rdist <= @rdist_outer")
+            params["rdist_outer"] = outer
+        if inner is not None:
+            band.append(f"{col}rdist > @rdist_inner")
+            params["rdist_inner"] = inner
+        if band:
+            clauses["rdist"] = f"({' and '.join(band)})"
+
+        if self.excl_ln:
+            # Exclude cells in lymph node for samples with ln annotations
+            clauses["ln"] = (
+                f"({ln}.lname is NULL "
+                f"or {ln}.ganno.STContains({cell}.pos) = 0)"
+            )
+
+        if self.reg_only:
+            clauses["reg"] = (
+                f"({reg}.lname = 'regression' "
+                f"and {reg}.ganno.STContains({cell}.pos) = 1)"
+            )
+
+        # Bin tdist to create histogram, convert tdist to um
+        if self.t_hist_type == "fractional reg":
+            params["t_step"] = _as_step(self.t_hist_step)
+            bin_expr = (
+                f"floor(({col}tdist2/({col}tdist2 - {col}rdist2))*100"
+                "/@t_step)*@t_step"
+            )
+        elif self.t_hist_step is not None:
+            # convert to pixels
+            params["t_step"] = _as_step(self.t_hist_step * 2)
+            bin_expr = f"floor({col}tdist/@t_step)*@t_step/2"
+        else:
+            bin_expr = ""
+
+        if bin_expr:
+            bin_apply = f"cross apply (select {bin_expr} tdist_bin) tb"
+            bin_select = ", tb.tdist_bin"
+        else:
+            bin_apply = ""
+            bin_select = ""
+
+        where = "\n    and ".join(clauses.values()) or "1 = 1"
+
+        return CompiledFilter(
+            where, clauses, bin_expr, bin_apply, bin_select, bin_select, params
+        )
+
+
+def _sql_type(value):
+    if isinstance(value, str):
+        return "nvarchar(max)"
+    if isinstance(value, (int, np.integer)):
+        return "int"
+
+    return "float"
+
+
+def _literal(value):
+    if isinstance(value, str):
+        return "N'" + value.replace("'", "''") + "'"
+
+    return repr(value.item() if isinstance(value, np.generic) else value)
+
+
+def inline_params(sql, params):
+    """Substitute literal values for @params, e.g. for printing a query."""
+
+    return re.sub(
+        r"@(\w+)",
+        lambda m: _literal(params[m[1]]) if m[1] in params else m[0],
+        sql,
+    )
+
+
+def param_sql(sql, params):
+    """Wrap sql in sp_executesql with params so its plan can be reused."""
+
+    if not params:
+        return sql
+
+    decl = ", ".join(f"@{k} {_sql_type(v)}" for k, v in params.items())
+    args = ", ".join(f"@{k} = {_literal(v)}" for k, v in params.items())
+    body = sql.replace("'", "''")
+
+    return f"exec sp_executesql N'{body}', N'{decl}', {args}"
@@ -0,0 +1,291 @@
+"""Cache of annotation geometries per (database, sampleid, lname), plus the
+buffers and tdist rings derived from them. Geometries are kept in an
+in-memory LRU and, when enable_cache has been called, as WKB files in the
+query cache directory, where they expire, count towards the size cap and are
+dropped by invalidate_cache like query results. Distances are in the same
+(pixel) units as STBuffer.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import shapely
+from .db_session import get_db, db_name
+from .filter_spec import param_sql, sampleid_in
+from .query_cache import (
+    cache_path,
+    cached_files,
+    invalidate_cache,
+    on_invalidate,
+    store_files,
+)
+
+# Number of geometries (raw, buffered or rings) held in memory beyond the
+# largest get_geometries request so far, which always fits
+MAX_GEOMS = 4096
+
+_LRU = OrderedDict()
+_LOCK = threading.Lock()
+_CAPACITY = {"n": MAX_GEOMS}
+# Marks a sample without the annotation, so it isn't re-queried
+_MISSING = "missing"
+
+
+def _get(key):
+    with _LOCK:
+        if key not in _LRU:
+            return None
+        _LRU.move_to_end(key)
+        return _LRU[key]
+
+
+def _put(key, geom):
+    with _LOCK:
+        _LRU[key] = geom
+        _LRU.move_to_end(key)
+        while len(_LRU) > _CAPACITY["n"]:
+            _LRU.popitem(last=False)
+
+
+def _reserve(n):
+    # Room for a request's n geometries, so a cohort's prefetch isn't evicted
+    # before it is read
+    with _LOCK:
+        _CAPACITY["n"] = max(_CAPACITY["n"], n + MAX_GEOMS)
+
+
+def _disk_file(name, sampleid, lname):
+    # Path within the cache directory; None when there is nowhere to write
+    if cache_path() is None or not isinstance(name, str):
+        return None
+
+    return f"geoms/{name}/{sampleid}_{lname.replace(' ', '_')}.wkb"
+
+
+def _full_path(file):
+    return os.path.join(cache_path(), *file.split("/"))
+
+
+def _read_disk(name, keys):
+    # {(sampleid, lname): geometry} of the keys fresh on disk, checking the
+    # index once for all of them
+    files = {key: _disk_file(name, *key) for key in keys}
+    fresh = cached_files([f for f in files.values() if f is not None])
+
+    geoms = {}
+    for key, file in files.items():
+        if file not in fresh:
+            continue
+        try:
+            with open(_full_path(file), "rb") as f:
+                wkb = f.read()
+        except FileNotFoundError:
+            continue
+        # Empty file: the sample has no such annotation
+        geoms[key] = shapely.from_wkb(wkb) if wkb else _MISSING
+
+    return geoms
+
+
+def _write_disk(name, geoms):
+    # Write {(sampleid, lname): geometry}, then index them in one go
+    files = {}
+    for (sampleid, lname), geom in geoms.items():
+        file = _disk_file(name, sampleid, lname)
+        if file is None:
+            continue
+        path = _full_path(file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write then swap, so an interrupted write never leaves an empty file
+        # that would read back as a missing annotation
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(b"" if geom is _MISSING else shapely.to_wkb(geom))
+        os.replace(tmp, path)
+        files[file] = [sampleid]
+
+    store_files(files, name, kind="geoms")
+
+
+def _source(database, altdb):
+    # Cache namespace: the database the annotations actually come from, or
+    # the session itself (memory only) when its name is unknown
+    if altdb is not None:
+        return altdb
+    db = get_db(database)
+    name = db_name(db)
+
+    return db if name is None else name
+
+
+def _forget(database, sampleid):
+    # Drop geometries from memory; registered with invalidate_cache
+    if sampleid is not None:
+        if np.isscalar(sampleid):
+            sampleid = [sampleid]
+        sampleid = {int(s) for s in sampleid}
+
+    with _LOCK:
+        for key in list(_LRU):
+            if database is not None and key[0] != database:
+                continue
+            if sampleid is not None and key[1] not in sampleid:
+                continue
+            del _LRU[key]
+
+
+on_invalidate(_forget)
+
+
+def get_geometries(sampleid, lname, database="wsi02", altdb=None):
+    """Annotation polygons, fetched from the server only when not cached.
+    Every uncached sample and lname comes back in one query, and the
+    in-memory cache grows to hold the whole request.
+    sampleid: int or list
+    lname: annotation name, e.g. 'tumor', or a list of names
+    database: database name or pooled session from get_db
+    altdb: for referencing datatbases not directly accessible (e.g. wsi14)
+    Returns {sampleid: geometry}, None where a sample has no such annotation;
+    {lname: {sampleid: geometry}} when lname is a list
+    """
+
+    if np.isscalar(sampleid):
+        sampleid = [sampleid]
+    sampleid = [int(s) for s in sampleid]
+    lnames = [lname] if isinstance(lname, str) else list(lname)
+
+    db = get_db(database)
+    name = _source(db, altdb)
+    _reserve(len(sampleid) * len(lnames))
+
+    geoms = {}
+    for ln in lnames:
+        for s in sampleid:
+            geom = _get((name, s, ln))
+            if geom is not None:
+                geoms[(s, ln)] = geom
+
+    todo = [(s, ln) for ln in lnames for s in sampleid if (s, ln) not in geoms]
+    on_disk = _read_disk(name, todo)
+    for key, geom in on_disk.items():
+        _put((name, *key), geom)
+    geoms.update(on_disk)
+    todo = [key for key in todo if key not in on_disk]
+
+    if todo:
+        altdb_sql = "" if altdb is None else f"{altdb}."
+        sql = f"""
+        select a.sampleid, a.lname, a.ganno.STAsBinary() wkb
+        from {altdb_sql}dbo.annotations a
+        where {sampleid_in("a.sampleid")}
+        and a.lname in (select value from string_split(@lnames, ','))
+        """
+        params = {
+            "sampleids": ",".join(map(str, sorted({s for s, _ in todo}))),
+            "lnames": ",".join(sorted({ln for _, ln in todo})),
+        }
+        annos = db.query(param_sql(sql, params))
+
+        fetched = {}
+        for s, ln, wkb in zip(annos["sampleid"], annos["lname"], annos["wkb"]):
+            fetched.setdefault((int(s), ln), []).append(shapely.from_wkb(wkb))
+
+        new = {}
+        for s, ln in todo:
+            # Samples can have several polygons with the same lname
+            if (s, ln) in fetched:
+                geom = shapely.union_all(fetched[(s, ln)])
+            else:
+                geom = _MISSING
+            _put((name, s, ln), geom)
+            new[(s, ln)] = geom
+        _write_disk(name, new)
+        geoms.update(new)
+
+    result = {
+        ln: {
+            s: None if geoms[(s, ln)] is _MISSING else geoms[(s, ln)]
+            for s in sampleid
+        }
+        for ln in lnames
+    }
+
+    return result[lname] if isinstance(lname, str) else result
+
+
+def get_geometry(sampleid, lname, database="wsi02", altdb=None):
+    """Single-sample get_geometries."""
+
+    return get_geometries(sampleid, lname, database, altdb)[int(sampleid)]
+
+
+def buffered(sampleid, lname, distance, database="wsi02", altdb=None):
+    """Memoized geometry.buffer(distance); None if the annotation is absent.
+    A distance of None or 0 returns the geometry itself.
+    """
+
+    geom = get_geometry(sampleid, lname, database, altdb)
+    if geom is None or not distance:
+        return geom
+
+    key = (_source(database, altdb), int(sampleid), lname, "buffer", distance)
+    result = _get(key)
+    if result is None:
+        result = shapely.buffer(geom, distance)
+        shapely.prepare(result)
+        _put(key, result)
+
+    return result
+
+
+def tdist_band(good, tumor, outer=None, inner=None):
+    """Good tissue within (outer, inner] of the tumor, as in the get_cell_den
+    area query: buffer(outer) - buffer(inner), intersected with good tissue,
+    from geometries already in hand (e.g. from get_geometries). Either bound
+    can be None; a bound of 0 is the tumor itself. Without a tumor returns
+    the good tissue; None without good tissue.
+    """
+
+    if good is None or tumor is None or (outer is None and inner is None):
+        return good
+
+    ring = good
+    if outer is not None:
+        ring = shapely.intersection(
+            shapely.buffer(tumor, outer) if outer else tumor, good
+        )
+    if inner is not None:
+        ring = shapely.difference(
+            ring, shapely.buffer(tumor, inner) if inner else tumor
+        )
+
+    return ring
+
+
+def tdist_ring(sampleid, outer=None, inner=None, database="wsi02", altdb=None):
+    """Memoized tdist_band of a sample's good tissue and tumor annotations."""
+
+    good = get_geometry(sampleid, "good tissue", database, altdb)
+    tumor = get_geometry(sampleid, "tumor", database, altdb)
+    if good is None or tumor is None or (outer is None and inner is None):
+        return good
+
+    key = (_source(database, altdb), int(sampleid), "ring", outer, inner)
+    ring = _get(key)
+    if ring is None:
+        ring = tdist_band(good, tumor, outer, inner)
+        _put(key, ring)
+
+    return ring
+
+
+def clear_geom_cache(database=None, sampleid=None):
+    """Drop cached geometries, in memory and on disk. invalidate_cache does
+    this too, along with the query results.
+    database: database (or altdb) name, defaults to all
+    sampleid: int or list, defaults to all
+    """
+
+    invalidate_cache(database, sampleid, kind="geoms")
@@ -1,6 +1,6 @@
 """Query annotations."""
 
-from astropathdb import AstroDB
+from .db_session import get_db
 
 
 def get_annos(
@@ -27,7 +27,8 @@ def get_annos(
 
     if database is None:
         print("Defaulting to wsi02...")
-        database = AstroDB(database="wsi02")
+        database = "wsi02"
+    database = get_db(database)
 
     if shortcut is None:
         shortcut = ""
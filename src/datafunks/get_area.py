@@ -1,7 +1,10 @@
 """get_areas computes tissue area from the predefined randomcell density."""
 
-from astropathdb import AstroDB
-from .dynamic_query import dynamic_sql
+from .compact import compact_frame
+from .db_session import get_db
+from .exact_area import exact_area
+from .filter_spec import FilterSpec, param_sql
+from .query_cache import cached_query
 
 
 def get_area(
@@ -15,11 +18,14 @@ def get_area(
     t_hist_step=None,
     altdb=None,
     t_hist_type=None,
+    spec=None,
+    compact=False,
+    engine="randomcell",
 ):
     """Computes tissue area from the predefined randomcell density.
     sampleid: int or list. defaults to all in db
     pheno: str or list. defaults to all
-    database: AstroDB object, defaults to AstroDB(database='wsi02')
+    database: database name or pooled session, defaults to wsi02
     tdist_filter: (outer, inner) bounds in microns; outer bound if not tuple
     rdist_filter: (outer, inner) bounds in microns; outer bound if not tuple
     all_reg: defaults to False
@@ -27,25 +33,42 @@ def get_area(
     t_hist_step: defaults to 50 micron bins. Setting to None gets all cells
     altdb: for referencing datatbases not directly accessible (e.g. wsi14)
     t_hist_type: input I was workshopping to accommodate percent distance bins
+    spec: FilterSpec; overrides sampleid, phenos and the filter arguments
+    compact: defaults to False; when True, use compact dtypes (compact_frame)
+    engine: "randomcell" (default) counts randomcell rows; "exact" measures
+        the annotation polygons locally (exact_area), skipping samples without
+        a tumor annotation
     """
 
     # Preprocess inputs ========================
-    if sampleid is None:
-        sampleid = [114]
-    elif isinstance(sampleid, int):
-        sampleid = [sampleid]
+    if spec is None:
+        spec = FilterSpec(
+            sampleid,
+            phenos,
+            tdist_filter,
+            rdist_filter,
+            all_reg,
+            excl_ln,
+            t_hist_step=t_hist_step,
+            t_hist_type=t_hist_type,
+        )
+
+    if spec.sampleid is None:
+        spec = spec.replace(sampleid=[114])
+    t_hist_step = spec.t_hist_step
 
     if database is None:
         print("Defaulting to wsi02.")
-        database = AstroDB(database="wsi02")
+        database = "wsi02"
+    database = get_db(database)
 
-    if not isinstance(tdist_filter, tuple):
-        # outer, then inner bounds
-        tdist_filter = (tdist_filter, None)
-
-    if not isinstance(rdist_filter, tuple):
-        # outer, then inner bounds
-        rdist_filter = (rdist_filter, None)
+    if engine == "exact":
+        area = exact_area(spec, database, altdb)
+        if compact:
+            area = compact_frame(area)
+        return area
+    if engine != "randomcell":
+        raise ValueError(f"Unknown area engine: {engine}")
 
     if altdb is None:
         altdb = ""
@@ -53,35 +76,29 @@ def get_area(
         altdb = f"{altdb}."
     # ===========================================
 
-    # Dynamic sql ==========================================================
-    phenos, tdist_sql, rdist_sql, ln_sql, t_hist_sql, group_sql = dynamic_sql(
-        phenos,
-        tdist_filter,
-        rdist_filter,
-        all_reg,
-        excl_ln,
-        t_hist_step,
-        t_hist_type,
-    )
-
     # Normalization Unit Ratio to convert randomcell density to area
     nur = 8000.0000 / (1.004 * 1.344)
 
-    # Query based on filters
+    # Query based on filters; phenos don't apply to randomcell ==============
+    filt = spec.compile(cell="c", reg="r", ln="ln", pheno=None)
+
     sql = f"""
-    select c.sampleid, {t_hist_sql}count(*)/{nur} area_mm
+    select c.sampleid{filt.bin_select}, count(*)/{nur} area_mm
     from {altdb}dbo.randomcell c
     left join {altdb}dbo.annotations r
         on (c.sampleid = r.sampleid and r.lname = 'regression')
     left join {altdb}dbo.annotations ln
         on (c.sampleid = ln.sampleid and ln.lname = 'lymph node')
-    where c.sampleid in ({",".join([f"'{x}'" for x in sampleid])})
-    {tdist_sql}
-    {rdist_sql}
-    {ln_sql}
-    group by c.sampleid{group_sql}
+    {filt.bin_apply}
+    where {filt.where}
+    group by c.sampleid{filt.bin_group}
     """
-    area = database.query(sql)
+    area = cached_query(
+        database,
+        param_sql(sql, filt.params),
+        altdb=altdb,
+        sampleids=list(spec.sampleid),
+    )
 
     # =======================================================================
 
@@ -92,4 +109,7 @@ def get_area(
     else:
         area = area.sort_values("sampleid").reset_index(drop=True)
 
+    if compact:
+        area = compact_frame(area)
+
     return area
@@ -1,6 +1,40 @@
 """Get cell coordinates for a specified phenotype and analysis boundary"""
 
-from astropathdb import AstroDB
+import numpy as np
+import pandas as pd
+from .compact import compact_frame
+from .db_session import get_db, db_name
+from .filter_spec import FilterSpec, param_sql
+from .membership import get_anno_geoms, membership_mask, tag_membership
+
+COLS = ["phenotype", "exprphenotype", "tdist", "px", "py"]
+
+
+def _coords_sql(sampleid, pheno, tdist_filter, excl_ln, reg_only, all_reg):
+    # Shared from/where clause for get_cell_coords and iter_cell_coords
+    spec = FilterSpec(
+        sampleid,
+        pheno,
+        tdist_filter,
+        all_reg=all_reg,
+        excl_ln=excl_ln,
+        reg_only=reg_only,
+    )
+    filt = spec.compile(
+        cell="ct", reg="d", ln="ln", inclusive=True, spatial_reg=True
+    )
+
+    from_sql = f"""
+    from dbo.celltag ct
+    JOIN dbo.phenotype p on ct.ptype = p.ptype
+    LEFT JOIN dbo.annotations ln on ct.sampleid = ln.sampleid
+        and ln.lname = 'lymph node'
+    LEFT JOIN dbo.annotations d on ct.sampleid = d.sampleid
+        and d.lname = 'regression'
+    where {filt.where}
+    """
+
+    return from_sql, filt.params
 
 
 def get_cell_coords(
@@ -11,11 +45,22 @@ def get_cell_coords(
     excl_ln=False,
     reg_only=False,
     all_reg=False,
+    compact=False,
+    chunk_size=50,
+    partition=False,
+    local=False,
 ):
     """Get cell coordinates for a specified phenotype and analysis boundary
-    sampleid: int or list. defaults to all in db
-    pheno: str or list. defaults to all
-    database
+    sampleid: int or list. defaults to 114
+    pheno: str or list. defaults to CD8
+    database: database name or pooled session from get_db
+    compact: defaults to False; when True, use compact dtypes (compact_frame)
+    chunk_size: number of samples per query, defaults to 50
+    partition: defaults to False; when True, return {sampleid: cells}
+    local: defaults to False; when True, evaluate the lymph node and
+        regression filters locally against each sample's polygons instead of
+        STContains per cell on the server. Adds in_tumor, in_reg and in_ln
+        columns, which membership_mask can reuse for other filters
     """
 
     if sampleid is None or pheno is None:
@@ -29,79 +74,143 @@ def get_cell_coords(
             pheno = "CD8"
             print(f"Pheno not provided. Defaulting to {pheno}.")
 
-    print(f"Querying {database}, {sampleid} {pheno}.")
+    print(f"Querying {db_name(database)}, {sampleid} {pheno}.")
 
-    db = AstroDB(database=database)
+    db = get_db(database)
 
-    if not isinstance(tdist_filter, tuple):
-        # outer, then inner bounds
-        tdist_filter = (tdist_filter, None)
+    sampleid = [sampleid] if np.isscalar(sampleid) else list(sampleid)
 
-    if tdist_filter[0] is not None and tdist_filter[1] is not None:
-        if all_reg:
-            tdist_filt = f"""
-            and ((ct.tdist <= {tdist_filter[0]}
-            and ct.tdist >= {tdist_filter[1]})
-                or d.ganno.STContains(ct.pos) = 1)
-            """
-        else:
-            tdist_filt = f"""
-            and (ct.tdist <= {tdist_filter[0]}
-            and ct.tdist >= {tdist_filter[1]})
-            """
-    elif tdist_filter[0] is not None:
-        if all_reg:
-            tdist_filt = f"""
-            and (ct.tdist <= {tdist_filter[0]}
-                or d.ganno.STContains(ct.pos) = 1)
-            """
-        else:
-            tdist_filt = f"""
-            and ct.tdist <= {tdist_filter[0]}
-            """
-    elif tdist_filter[1] is not None:
-        if all_reg:
-            tdist_filt = f"""
-            and (ct.tdist >= {tdist_filter[1]}
-                or d.ganno.STContains(ct.pos) = 1)
-            """
-        else:
-            tdist_filt = f"""
-            and ct.tdist >= {tdist_filter[1]}
-            """
+    if local:
+        # Only a plain tdist band is left for the server
+        spec = FilterSpec(
+            tdist_filter=tdist_filter,
+            all_reg=all_reg,
+            excl_ln=excl_ln,
+            reg_only=reg_only,
+        )
+        server_filters = (
+            None if all_reg else tdist_filter,
+            False,
+            False,
+            False,
+        )
     else:
-        tdist_filt = ""
+        server_filters = (tdist_filter, excl_ln, reg_only, all_reg)
 
-    if excl_ln:
-        # Exclude cells in lymph node for samples with ln annotations
-        ln_sql = """
-        and (c.ganno.STContains(ct.pos) = 0 or c.lname is NULL)
-        """
-    else:
-        ln_sql = ""
+    # All phenotypes for a chunk of samples per query
+    cells_list = []
+    for start in range(0, len(sampleid), chunk_size):
+        stop = start + chunk_size
+        from_sql, params = _coords_sql(
+            sampleid[start:stop], pheno, *server_filters
+        )
 
-    if reg_only:
-        # Only cells in regression
-        reg_sql = """
-        and (d.ganno.STContains(ct.pos) = 1 and d.lname = 'regression')
+        sql = f"""
+        select ct.sampleid, p.phenotype, ct.exprphenotype, ct.tdist,
+            ct.px, ct.py
+        {from_sql}
         """
-    else:
-        reg_sql = ""
+        cells_list.append(db.query(param_sql(sql, params)))
+
+    cells = pd.concat(cells_list).reset_index(drop=True)
+
+    if local:
+        geoms = get_anno_geoms(
+            sampleid, db, lnames=("tumor", "regression", "lymph node")
+        )
+        cells = tag_membership(cells, geoms)
+        cells = cells[membership_mask(cells, spec)].reset_index(drop=True)
 
+    if compact:
+        cells = compact_frame(cells)
+
+    if partition:
+        return {
+            s: group.reset_index(drop=True)
+            for s, group in cells.groupby("sampleid", sort=True)
+        }
+
+    return cells
+
+
+def iter_cell_coords(
+    sampleid=None,
+    pheno=None,
+    database="wsi02",
+    tdist_filter=None,
+    excl_ln=False,
+    reg_only=False,
+    all_reg=False,
+    batch_size=1_000_000,
+    arrow=False,
+    compact=False,
+):
+    """Stream cell coordinates in fixed-size batches, so whole-slide pulls
+    never have to fit in memory at once. Pages are fetched one at a time,
+    ordered by (sampleid, cellid), each resuming after the last cell of the
+    previous page. This relies on celltag having a unique, indexed
+    (sampleid, cellid) key, as the AstroPath celltag primary key is; without
+    one, every page re-runs the full filtered join and sort.
+    sampleid: int or list. defaults to 114
+    pheno: str or list. defaults to CD8, as in get_cell_coords
+    database: database name or pooled session from get_db
+    batch_size: cells per batch, defaults to 1,000,000
+    arrow: defaults to False; yield pyarrow RecordBatches instead of dicts of
+        NumPy arrays
+    compact: defaults to False; when True, use compact dtypes (compact_frame)
+    Yields sampleid, phenotype, exprphenotype, tdist, px and py per batch.
+    """
+
+    if sampleid is None:
+        sampleid = 114
+        print(f"Sampleid not provided. Defaulting to {sampleid}.")
+    if pheno is None:
+        pheno = "CD8"
+        print(f"Pheno not provided. Defaulting to {pheno}.")
+
+    db = get_db(database)
+
+    from_sql, params = _coords_sql(
+        sampleid, pheno, tdist_filter, excl_ln, reg_only, all_reg
+    )
+
+    # Keyset pagination: each page resumes after the last (sampleid, cellid)
     sql = f"""
-    select p.phenotype, ct.exprphenotype, ct.tdist, ct.px, ct.py
-    from dbo.celltag ct
-    JOIN dbo.phenotype p on ct.ptype = p.ptype
-    LEFT JOIN dbo.annotations c on ct.sampleid = c.sampleid
-        and c.lname = 'lymph node'
-    LEFT JOIN dbo.annotations d on ct.sampleid = d.sampleid
-        and d.lname = 'regression'
-    where p.phenotype = '{pheno}'
-    and ct.sampleid = {sampleid}
-    {ln_sql}
-    {reg_sql}
-    {tdist_filt}
+    select top (@batch_size) ct.sampleid, ct.cellid, p.phenotype,
+        ct.exprphenotype, ct.tdist, ct.px, ct.py
+    {from_sql}
+    and (ct.sampleid > @last_sample
+        or (ct.sampleid = @last_sample and ct.cellid > @last_cell))
+    order by ct.sampleid, ct.cellid
     """
-    cells = db.query(sql)
+    params = {**params, "batch_size": int(batch_size)}
+    last_sample, last_cell = -1, -1
 
-    return cells
+    if arrow:
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+    while True:
+        page_params = {
+            **params,
+            "last_sample": last_sample,
+            "last_cell": last_cell,
+        }
+        page = db.query(param_sql(sql, page_params))
+
+        if page.empty:
+            return
+
+        last_sample = int(page["sampleid"].iloc[-1])
+        last_cell = int(page["cellid"].iloc[-1])
+
+        page = page[["sampleid", *COLS]]
+        if compact:
+            page = compact_frame(page.copy())
+        if arrow:
+            yield pa.RecordBatch.from_pandas(page, preserve_index=False)
+        else:
+            # Categorical columns come through as pandas Categoricals
+            yield {col: page[col].values for col in page.columns}
+
+        if len(page) < batch_size:
+            return
@@ -1,10 +1,67 @@
 """get_cell_counts counts cells within user-defined filters."""
 
-from astropathdb import AstroDB
 import pandas as pd
 import numpy as np
-from .dynamic_query import dynamic_sql
+from .compact import compact_frame
+from .db_session import get_db
+from .filter_spec import FilterSpec, param_sql
 from .expr_total import expr_total
+from .query_cache import cached_query
+
+
+def complete_counts(cells, t_hist_step=None):
+    """Zero-fill missing exprphenotypes (or tdist bins, when binned) and add
+    the Total exprphenotype rows, as returned by get_cell_counts.
+    cells: sampleid, phenotype, exprphenotype, [tdist_bin,] c
+    t_hist_step: bin width of tdist_bin, None if not binned
+    """
+
+    if cells.empty:
+        # No counts to fill around (or total)
+        return cells
+
+    # Add 0'd row for phenos with no counts, as one reindex over every
+    # combination of present groups and expected bins/exprphenotypes
+    if t_hist_step is None:
+        # Every exprphenotype in the cohort for each sampleid/phenotype
+        # Still relies on expr being present in cell df
+        # Can make specific to the db
+        keys = ["sampleid", "phenotype", "exprphenotype"]
+        groups = cells[keys[:2]].drop_duplicates()
+        fill = cells["exprphenotype"].unique()
+    else:
+        # Every bin in the overall tdist range for each group
+        keys = ["sampleid", "phenotype", "exprphenotype", "tdist_bin"]
+        groups = cells[keys[:3]].drop_duplicates()
+        tdist_total = cells["tdist_bin"].unique()
+        fill = np.arange(
+            tdist_total.min(), tdist_total.max() + t_hist_step, t_hist_step
+        )
+
+    if len(groups):
+        codes = np.repeat(np.arange(len(groups)), len(fill))
+        full = groups.iloc[codes].reset_index(drop=True)
+        full[keys[-1]] = np.tile(fill, len(groups))
+
+        cells = (
+            cells.set_index(keys)["c"]
+            .reindex(pd.MultiIndex.from_frame(full), fill_value=0)
+            .reset_index()
+            .sort_values(keys)
+            .reset_index(drop=True)
+        )
+
+        if t_hist_step is not None:
+            # Convert to int (should already be)
+            cells["tdist_bin"] = cells["tdist_bin"].astype(int)
+
+    # Get a row for the total cell inclusive of all exprphenotypes
+    if t_hist_step is not None:
+        cells = expr_total(cells, ["sampleid", "phenotype", "tdist_bin"])
+    else:
+        cells = expr_total(cells, ["sampleid", "phenotype"])
+
+    return cells
 
 
 def get_cell_counts(
@@ -18,11 +75,13 @@ def get_cell_counts(
     t_hist_step=None,
     altdb=None,
     t_hist_type=None,
+    spec=None,
+    compact=False,
 ):
     """
     sampleid: int or list. defaults to all in db
     pheno: str or list. defaults to all
-    database: AstroDB object, defaults to AstroDB(database='wsi02')
+    database: database name or pooled session, defaults to wsi02
     tdist_filter: (outer, inner) bounds in microns; outer bound if not tuple
     rdist_filter: (outer, inner) bounds in microns; outer bound if not tuple
     all_reg: defaults to False
@@ -30,26 +89,32 @@ def get_cell_counts(
     t_hist_step: defaults to 50 micron bins. Setting to None gets all cells
     altdb: for referencing datatbases not directly accessible (e.g. wsi14)
     t_hist_type: input I was workshopping to accommodate percent distance bins
+    spec: FilterSpec; overrides sampleid, phenos and the filter arguments
+    compact: defaults to False; when True, use compact dtypes (compact_frame)
     """
 
     # Preprocess inputs ========================
-    if sampleid is None:
-        sampleid = [114]
-        print(f"Defaulting to sampleid: {sampleid}.")
-    elif isinstance(sampleid, int):
-        sampleid = [sampleid]
+    if spec is None:
+        spec = FilterSpec(
+            sampleid,
+            phenos,
+            tdist_filter,
+            rdist_filter,
+            all_reg,
+            excl_ln,
+            t_hist_step=t_hist_step,
+            t_hist_type=t_hist_type,
+        )
+
+    if spec.sampleid is None:
+        spec = spec.replace(sampleid=[114])
+        print(f"Defaulting to sampleid: {list(spec.sampleid)}.")
+    t_hist_step = spec.t_hist_step
 
     if database is None:
         print("Defaulting to wsi02.")
-        database = AstroDB(database="wsi02")
-
-    if not isinstance(tdist_filter, tuple):
-        # outer, then inner bounds
-        tdist_filter = (tdist_filter, None)
-
-    if not isinstance(rdist_filter, tuple):
-        # outer, then inner bounds
-        rdist_filter = (rdist_filter, None)
+        database = "wsi02"
+    database = get_db(database)
 
     if altdb is None:
         altdb = ""
@@ -57,23 +122,12 @@ def get_cell_counts(
         altdb = f"{altdb}."
     # ===========================================
 
-    # "Dynamic" sql ==========================================================
-    pheno_sql, tdist_sql, rdist_sql, ln_sql, t_hist_sql, group_sql = (
-        dynamic_sql(
-            phenos,
-            tdist_filter,
-            rdist_filter,
-            all_reg,
-            excl_ln,
-            t_hist_step,
-            t_hist_type,
-        )
-    )
+    # Query based on filters ================================================
+    filt = spec.compile(cell="c", reg="r", ln="ln", pheno="p")
 
-    # Query based on filters
     sql = f"""
-    select c.sampleid, p.phenotype, c.exprphenotype,
-    {t_hist_sql}count(*) c
+    select c.sampleid, p.phenotype, c.exprphenotype{filt.bin_select},
+    count(*) c
     from {altdb}dbo.celltag c
     left join {altdb}dbo.phenotype p
         on c.ptype = p.ptype
@@ -81,91 +135,24 @@ def get_cell_counts(
         on (c.sampleid = r.sampleid and r.lname = 'regression')
     left join {altdb}dbo.annotations ln
         on (c.sampleid = ln.sampleid and ln.lname = 'lymph node')
-    where c.sampleid in ({",".join([f"'{x}'" for x in sampleid])})
-    {tdist_sql}
-    {rdist_sql}
-    {ln_sql}
-    {pheno_sql}
-    group by c.sampleid, p.phenotype, c.exprphenotype{group_sql}
-    order by c.sampleid, p.phenotype, c.exprphenotype{group_sql}
+    {filt.bin_apply}
+    where {filt.where}
+    group by c.sampleid, p.phenotype, c.exprphenotype{filt.bin_group}
+    order by c.sampleid, p.phenotype, c.exprphenotype{filt.bin_group}
     """
-    cells = database.query(sql)
+    cells = cached_query(
+        database,
+        param_sql(sql, filt.params),
+        altdb=altdb,
+        sampleids=list(spec.sampleid),
+    )
     # =======================================================================
 
     # Post-process queried data =============================================
-    # Add 0'd row for phenos with no counts
-    if t_hist_step is None:
-        # Group cells to identify missing exprphenotypes
-        grouped = cells.groupby(["sampleid", "phenotype"])
-        # List all exprs across whole cohort
-        expr_list = cells["exprphenotype"].unique()
-
-        # Where expr not present
-        # Still relies on expr being present in cell df
-        # Can make specific to the db
-        miss_list = []
-        for name, group in grouped:
-            expr = group["exprphenotype"].values
-            missing_bins = [e for e in expr_list if e not in expr]
-
-            missing_rows = pd.DataFrame({"exprphenotype": missing_bins})
-            missing_rows["c"] = 0
-            missing_rows["sampleid"] = name[0]
-            missing_rows["phenotype"] = name[1]
-
-            miss_list.append(missing_rows)
-
-        if miss_list:
-            cells = pd.concat([cells, *miss_list])
-            cells = cells.sort_values(
-                ["sampleid", "phenotype", "exprphenotype"]
-            ).reset_index(drop=True)
-
-    else:
-        # Group cells to identify range of tdist and missing bins
-        grouped = cells.groupby(["sampleid", "phenotype", "exprphenotype"])
-        # Get total range of tdist from all cells
-        tdist_total = cells["tdist_bin"].unique()
-        # Calculate the anticipated number of bins from overall range
-        bins = np.arange(
-            tdist_total.min(), tdist_total.max() + t_hist_step, t_hist_step
-        )
-
-        # Where tdist bin not present
-        miss_list = []
-        for name, group in grouped:
-            # Get tdist bins for given group
-            tdist = group["tdist_bin"].values
-            # List anticipated bins not found in group tdist bins
-            missing_bins = [b.astype(int) for b in bins if b not in tdist]
-
-            # Add missing tdist bins and group labels to a df
-            missing_rows = pd.DataFrame({"tdist_bin": missing_bins})
-            missing_rows["c"] = 0
-            missing_rows["sampleid"] = name[0]
-            missing_rows["phenotype"] = name[1]
-            missing_rows["exprphenotype"] = name[2]
-            # Reorder columns, in case this matters (shouldn't)
-            missing_rows = missing_rows[
-                ["sampleid", "phenotype", "exprphenotype", "tdist_bin", "c"]
-            ]
-
-            miss_list.append(missing_rows)
-
-        if miss_list:
-            # Combine missing rows with original cells df
-            # missing_df = pd.concat(miss_list, ignore_index=True)
-            cells = pd.concat([cells, *miss_list]).reset_index(drop=True)
-
-            # Convert to int (should already be)
-            cells["tdist_bin"] = cells["tdist_bin"].astype(int)
-
-    # Get a row for the total cell inclusive of all exprphenotypes
-    if t_hist_step is not None:
-        cells = expr_total(cells, ["sampleid", "phenotype", "tdist_bin"])
-    else:
-        cells = expr_total(cells, ["sampleid", "phenotype"])
-
+    cells = complete_counts(cells, t_hist_step)
     # =======================================================================
 
+    if compact:
+        cells = compact_frame(cells)
+
     return cells
@@ -1,10 +1,42 @@
 """Get cell coordinates for a specified phenotype and analysis boundary"""
 
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-from shapely.wkt import loads
-from astropathdb import AstroDB
-from .anno_check import anno_check
+import shapely
+from .compact import compact_frame
+from .db_session import get_db, db_name
+from .filter_spec import FilterSpec, param_sql, sampleid_in
+from .geom_cache import get_geometries, tdist_band
+from .query_cache import cached_query
+
+
+def _local_region(sampleid, geoms, tdist_filter, excl_ln, reg_only, all_reg):
+    # The area CASE chain below, on the polygons fetched for the cohort
+    good = geoms["good tissue"][sampleid]
+    tumor = geoms["tumor"][sampleid]
+    ln = geoms["lymph node"][sampleid]
+    reg = geoms["regression"][sampleid]
+
+    if tumor is not None:
+        region = tdist_band(good, tumor, *tdist_filter)
+        if reg is not None:
+            if reg_only:
+                region = region & reg
+            if all_reg:
+                region = (region | reg) & good
+    else:
+        region = good
+        if reg_only or all_reg:
+            # Intersecting with a missing annotation gives NULL
+            if reg is None:
+                return None
+            region = region & reg
+
+    if excl_ln and ln is not None:
+        region = region - ln
+
+    return region
 
 
 def get_cell_den(
@@ -15,118 +47,99 @@ def get_cell_den(
     excl_ln=False,
     reg_only=False,
     all_reg=False,
+    chunk_size=100,
+    spec=None,
+    compact=False,
+    area_engine="sql",
+    n_jobs=None,
 ):
-    """Get cell coordinates for a specified phenotype and analysis boundary"""
+    """Get cell coordinates for a specified phenotype and analysis boundary
+    database: database name or pooled session from get_db
+    chunk_size: number of samples per area query, defaults to 100
+    spec: FilterSpec; overrides sampleid, pheno and the filter arguments
+    compact: defaults to False; when True, use compact dtypes and return
+        (den, geoms) with the geometry in a per-sample geoms table rather than
+        an anno column repeated on every row
+    area_engine: "sql" (default) builds the area geometry on the server;
+        "local" only fetches the raw annotations (cached, see geom_cache) and
+        builds it with shapely, one sample per thread
+    n_jobs: threads for the local engine, defaults to the executor's default
+    """
 
-    print(f"Querying {database}...")
+    print(f"Querying {db_name(database)}...")
 
-    if database == "wsi34":
+    if db_name(database) == "wsi34":
         database = "wsi02"
         wsi34_shortcut = "wsi34."
         print("Using wsi02.wsi34 to circumvent access issue...")
     else:
         wsi34_shortcut = ""
 
-    db = AstroDB(database=database)
+    db = get_db(database)
+    database = db_name(db)
+
+    if not isinstance(tdist_filter, tuple):
+        # outer, then inner bounds
+        tdist_filter = (tdist_filter, None)
+
+    if spec is None:
+        spec = FilterSpec(
+            sampleid,
+            pheno,
+            tdist_filter,
+            all_reg=all_reg,
+            excl_ln=excl_ln,
+            reg_only=reg_only,
+        )
+    else:
+        tdist_filter = spec.tdist_filter
+        all_reg, excl_ln, reg_only = spec.all_reg, spec.excl_ln, spec.reg_only
 
-    if sampleid is None:
+    if spec.sampleid is None:
+        # Semi-join on the cohort annotation rather than listing sampleids
         if reg_only:
-            sampleid_sql = f"""
-            ct.sampleid in ({",".join(map(str, anno_check("regression", db, shortcut=wsi34_shortcut)))})
-            """
+            cohort_anno = "regression"
             print(
                 f"""Sampleid not provided.
                 Defaulting to all samples with regression from {database}."""
             )
         else:
-            sampleid_sql = f"""
-            ct.sampleid in ({",".join(map(str, anno_check("good tissue", db, shortcut=wsi34_shortcut)))})
-            """
+            cohort_anno = "good tissue"
             print(
                 f"""Sampleid not provided.
                 Defaulting to all samples from {database}."""
             )
-    else:
-        if not isinstance(sampleid, list):
-            sampleid = [sampleid]
-        sampleid_sql = f"""
-        ct.sampleid in ({",".join(map(str, sampleid))})
+        cohort_sql = f"""
+        and exists (
+            select 1 from {wsi34_shortcut}dbo.annotations g
+            where g.sampleid = ct.sampleid and g.lname = '{cohort_anno}'
+        )
         """
+    else:
+        cohort_sql = ""
 
-    if pheno is None:
-        pheno_sql = ""
+    if spec.phenos is None:
         print("Pheno not provided. Defaulting to all phenotypes.")
-    else:
-        if not isinstance(pheno, list):
-            pheno = [pheno]
-        pheno_sql = f"""
-        and p.phenotype in ({",".join([f"'{x}'" for x in pheno])})
-        """
 
-    if not isinstance(tdist_filter, tuple):
-        # outer, then inner bounds
-        tdist_filter = (tdist_filter, None)
+    filt = spec.compile(
+        cell="ct", reg="d", ln="ln", inclusive=True, spatial_reg=True
+    )
 
     if tdist_filter[0] is not None and tdist_filter[1] is not None:
-        if all_reg:
-            tdist_sql = f"""
-            and ((ct.tdist <= {tdist_filter[0]}
-            and ct.tdist >= {tdist_filter[1]})
-                or (d.lname is not NULL and d.ganno.STContains(ct.pos) = 1))
-            """
-        else:
-            tdist_sql = f"""
-            and (ct.tdist <= {tdist_filter[0]}
-            and ct.tdist >= {tdist_filter[1]})
-            """
-        t_anno_sql = f"""
-        a.ganno.STBuffer({tdist_filter[0]}).STDifference(a.ganno.STBuffer({tdist_filter[1]})).STIntersection(b.ganno)
+        t_anno_sql = """
+        a.ganno.STBuffer(@tdist_outer).STDifference(a.ganno.STBuffer(@tdist_inner)).STIntersection(b.ganno)
         """
     elif tdist_filter[0] is not None:
-        if all_reg:
-            tdist_sql = f"""
-            and (ct.tdist <= {tdist_filter[0]}
-                or (d.lname is not NULL and d.ganno.STContains(ct.pos) = 1))
-            """
-        else:
-            tdist_sql = f"""
-            and ct.tdist <= {tdist_filter[0]}
-            """
-        t_anno_sql = f"""
-        a.ganno.STBuffer({tdist_filter[0]}).STIntersection(b.ganno)
+        t_anno_sql = """
+        a.ganno.STBuffer(@tdist_outer).STIntersection(b.ganno)
         """
     elif tdist_filter[1] is not None:
-        if all_reg:
-            tdist_sql = f"""
-            and (ct.tdist >= {tdist_filter[1]}
-                or (d.lname is not NULL and d.ganno.STContains(ct.pos) = 1))
-            """
-        else:
-            tdist_sql = f"""
-            and ct.tdist >= {tdist_filter[1]}
-            """
-        t_anno_sql = f"""
-        b.ganno.STDifference(a.ganno.STBuffer({tdist_filter[1]}))
+        t_anno_sql = """
+        b.ganno.STDifference(a.ganno.STBuffer(@tdist_inner))
         """
     else:
-        tdist_sql = ""
         t_anno_sql = "b.ganno"
 
-    if excl_ln:
-        ln_sql = """
-        and (ln.ganno.STContains(ct.pos) = 0 or ln.lname is NULL)
-        """
-    else:
-        ln_sql = ""
-
-    if reg_only:
-        reg_sql = """
-        and d.lname = 'regression'
-        and d.ganno.STContains(ct.pos) = 1
-        """
-    else:
-        reg_sql = ""
-
     print("Counting cells...")
 
     sql = f"""
@@ -137,14 +150,16 @@ def get_cell_den(
         and d.lname = 'regression'
     LEFT JOIN {wsi34_shortcut}dbo.annotations ln on ct.sampleid = ln.sampleid
         and ln.lname = 'lymph node'
-    WHERE {sampleid_sql}
-    {reg_sql}
-    {ln_sql}
-    {pheno_sql}
-    {tdist_sql}
+    WHERE {filt.where}
+    {cohort_sql}
     GROUP BY ct.sampleid, p.phenotype, ct.exprphenotype
     """
-    cells = db.query(sql)
+    cells = cached_query(
+        db,
+        param_sql(sql, filt.params),
+        altdb=wsi34_shortcut,
+        sampleids=None if spec.sampleid is None else list(spec.sampleid),
+    )
 
     if database == "wsi02":
         cells = cells[
@@ -156,10 +171,6 @@ def get_cell_den(
 
     samples = cells["sampleid"].unique()
 
-    # Add null value to avoid syntax error in annotation sql query
-    if len(samples) == 0:
-        samples = ["NULL"]
-
     if excl_ln:
         # Exclude cells in lymph node for samples with ln annotations
         ln_anno_sql = ".STDifference(c.ganno)"
@@ -182,67 +193,123 @@ def get_cell_den(
 
     print("Calculating areas...")
 
-    areas_list = []
-    for sample in samples:
-
-        print(sample)
-
-        sql = f"""
-        select b.sampleid,
-        CASE
-            when a.lname is not NULL and d.lname is not NULL and c.lname is not
-                NULL then {t_anno_sql}{reg_anno_sql}{all_reg_sql}{ln_anno_sql}
-            when a.lname is not NULL and d.lname is not NULL and c.lname is
-                NULL then {t_anno_sql}{reg_anno_sql}{all_reg_sql}
-            when a.lname is not NULL and d.lname is NULL and c.lname is not
-                NULL then {t_anno_sql}{ln_anno_sql}
-            when a.lname is not NULL and d.lname is NULL and c.lname is
-                NULL then {t_anno_sql}
-            when a.lname is NULL and c.lname is not NULL then b.ganno
-                {reg_anno_sql}{all_reg_sql2}{ln_anno_sql}
-            when a.lname is NULL and c.lname is NULL then b.ganno
-                {reg_anno_sql}{all_reg_sql2}
-        END anno
-        from {wsi34_shortcut}dbo.annotations b
-        left join {wsi34_shortcut}dbo.annotations a on b.sampleid = a.sampleid
-            and a.lname = 'tumor'
-        left join {wsi34_shortcut}dbo.annotations c on b.sampleid = c.sampleid
-            and c.lname = 'lymph node'
-        left join {wsi34_shortcut}dbo.annotations d on b.sampleid = d.sampleid
-            and d.lname = 'regression'
-        where b.sampleid in ({sample})
-        and b.lname = 'good tissue'
-        """
-        # ",".join(map(str, samples))
-        sample_area = db.query(sql)
-        areas_list.append(sample_area)
-
-    areas = pd.concat(areas_list)
-
-    # Add something here to fill in empty (dropped) rows
+    if area_engine == "local":
+        samples = [int(x) for x in samples]
+        geoms = get_geometries(
+            samples,
+            ["good tissue", "tumor", "lymph node", "regression"],
+            db,
+            wsi34_shortcut.rstrip(".") or None,
+        )
+        # Samples without good tissue drop out, as with the join on b
+        samples = [x for x in samples if geoms["good tissue"][x] is not None]
+
+        # shapely releases the GIL, so samples run concurrently on threads
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            regions = list(
+                pool.map(
+                    lambda x: _local_region(
+                        x, geoms, tdist_filter, excl_ln, reg_only, all_reg
+                    ),
+                    samples,
+                )
+            )
 
-    # It's faster to calculate areas outside of the query for some reason
-    areas["area"] = [
-        gpd.GeoSeries(loads(x)).area[0] * 2.5e-7 for x in areas["anno"]
-    ]
+        regions = np.array(regions, dtype=object)
+        areas = pd.DataFrame(
+            {
+                "sampleid": samples,
+                "anno": shapely.to_wkt(regions, rounding_precision=-1),
+                "area": shapely.area(regions) * 2.5e-7,
+            }
+        )
+    elif area_engine == "sql":
+        areas_list = []
+        for start in range(0, len(samples), chunk_size):
+            stop = start + chunk_size
+            chunk = samples[start:stop]
+
+            end = start + len(chunk)
+            print(f"Samples {start + 1}-{end} of {len(samples)}")
+
+            sql = f"""
+            select b.sampleid,
+            (CASE
+                when a.lname is not NULL and d.lname is not NULL
+                    and c.lname is not NULL
+                    then {t_anno_sql}{reg_anno_sql}{all_reg_sql}{ln_anno_sql}
+                when a.lname is not NULL and d.lname is not NULL
+                    and c.lname is NULL
+                    then {t_anno_sql}{reg_anno_sql}{all_reg_sql}
+                when a.lname is not NULL and d.lname is NULL
+                    and c.lname is not NULL
+                    then {t_anno_sql}{ln_anno_sql}
+                when a.lname is not NULL and d.lname is NULL
+                    and c.lname is NULL
+                    then {t_anno_sql}
+                when a.lname is NULL and c.lname is not NULL then b.ganno
+                    {reg_anno_sql}{all_reg_sql2}{ln_anno_sql}
+                when a.lname is NULL and c.lname is NULL then b.ganno
+                    {reg_anno_sql}{all_reg_sql2}
+            END).STAsBinary() anno
+            from {wsi34_shortcut}dbo.annotations b
+            left join {wsi34_shortcut}dbo.annotations a
+                on b.sampleid = a.sampleid and a.lname = 'tumor'
+            left join {wsi34_shortcut}dbo.annotations c
+                on b.sampleid = c.sampleid and c.lname = 'lymph node'
+            left join {wsi34_shortcut}dbo.annotations d
+                on b.sampleid = d.sampleid and d.lname = 'regression'
+            where {sampleid_in("b.sampleid")}
+            and b.lname = 'good tissue'
+            """
+            area_params = {
+                k: v for k, v in filt.params.items() if k.startswith("tdist_")
+            }
+            area_params["sampleids"] = ",".join(map(str, chunk))
+            chunk_area = cached_query(
+                db,
+                param_sql(sql, area_params),
+                altdb=wsi34_shortcut,
+                sampleids=list(chunk),
+            )
+            areas_list.append(chunk_area)
 
-    # Combine with cells to calculate density
-    den = pd.merge(cells, areas, on="sampleid").reset_index(drop=True)
+        if areas_list:
+            areas = pd.concat(areas_list)
+        else:
+            # No samples to measure, and nothing queried
+            areas = pd.DataFrame({"sampleid": [], "anno": []})
+
+        # It's faster to calculate areas outside of the query for some reason
+        # Geometry comes back as WKB; decode and measure every row in one go
+        # and convert pixels (0.5 um) to mm^2
+        regions = shapely.from_wkb(areas["anno"].to_numpy())
+        areas["area"] = shapely.area(regions) * 2.5e-7
+        # anno stays WKT text, as callers loads() it
+        areas["anno"] = shapely.to_wkt(regions, rounding_precision=-1)
+    else:
+        raise ValueError(f"Unknown area engine: {area_engine}")
 
-    # In case of providing plots
-    # den["pos"] = den["pos"].apply(loads).apply(gpd.GeoSeries)
+    # Add something here to fill in empty (dropped) rows
 
     # Get a row for the total cell inclusive of all exprphenotypes
     total = (
-        den.groupby(["sampleid", "phenotype", "anno", "area"], as_index=False)[
-            "c"
-        ]
+        cells.groupby(["sampleid", "phenotype"], as_index=False)["c"]
         .sum()
         .reset_index(drop=True)
     )
     total["exprphenotype"] = "Total"
 
-    den = pd.concat([den, total]).reset_index(drop=True)
+    cells = pd.concat([cells, total]).reset_index(drop=True)
+
+    # Combine with cells to calculate density
+    if compact:
+        geoms = areas[["sampleid", "anno", "area"]].reset_index(drop=True)
+        areas = areas[["sampleid", "area"]]
+    den = pd.merge(cells, areas, on="sampleid").reset_index(drop=True)
+
+    # In case of providing plots
+    # den["pos"] = den["pos"].apply(loads).apply(gpd.GeoSeries)
 
     den["density"] = den["c"] / den["area"]
 
@@ -252,4 +319,7 @@ def get_cell_den(
 
     print("Done.")
 
+    if compact:
+        return compact_frame(den), compact_frame(geoms)
+
     return den
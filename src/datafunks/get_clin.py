@@ -1,10 +1,15 @@
 """Queries the clinical data for the relevant cohort and matches by patient.
 Of little use- all clin tables are different and wsi02 is not up-to-date."""
 
-from astropathdb import AstroDB
+from .compact import compact_frame
+from .db_session import get_db, db_name
+from .query_cache import cached_query
 
 
-def get_clin(sampleid=None, database="wsi02"):
+def get_clin(sampleid=None, database="wsi02", compact=False):
+
+    db = get_db(database)
+    database = db_name(db)
 
     if database == "wsi02":
         print("Recall that wsi02 clin info not up-to-date in database.")
@@ -31,13 +36,14 @@ def get_clin(sampleid=None, database="wsi02"):
             )
         """
 
-    db = AstroDB(database=database)
-
     sql = f"""
     select *
     from dbo.clinical c
     {sampleid_sql}
     """
-    clin = db.query(sql)
+    clin = cached_query(db, sql, sampleids=sampleid)
+
+    if compact:
+        clin = compact_frame(clin)
 
     return clin
@@ -0,0 +1,143 @@
+"""get_density counts cells and randomcell area in one query."""
+
+from .compact import compact_frame
+from .db_session import get_db
+from .get_cell_counts import complete_counts
+from .filter_spec import FilterSpec, param_sql
+from .query_cache import cached_query
+
+# Normalization Unit Ratio to convert randomcell density to area
+NUR = 8000.0000 / (1.004 * 1.344)
+
+
+def get_density(
+    sampleid=None,
+    database=None,
+    phenos=None,
+    tdist_filter=None,
+    rdist_filter=None,
+    all_reg=False,
+    excl_ln=False,
+    t_hist_step=None,
+    altdb=None,
+    t_hist_type=None,
+    spec=None,
+    compact=False,
+):
+    """Cell counts and randomcell area per sample (and tdist bin) in a single
+    batch. Equivalent to merging get_cell_counts with get_area: both
+    aggregates come back in one result, then missing bins/exprphenotypes are
+    zero-filled locally and kept only where there is area to divide by.
+    sampleid: int or list. defaults to 114
+    phenos: str or list. defaults to all
+    database: database name or pooled session, defaults to wsi02
+    tdist_filter: (outer, inner) bounds in microns; outer bound if not tuple
+    rdist_filter: (outer, inner) bounds in microns; outer bound if not tuple
+    all_reg: defaults to False
+    excl_ln: defaults to False
+    t_hist_step: defaults to 50 micron bins. Setting to None gets all cells
+    altdb: for referencing datatbases not directly accessible (e.g. wsi14)
+    t_hist_type: input I was workshopping to accommodate percent distance bins
+    spec: FilterSpec; overrides sampleid, phenos and the filter arguments
+    compact: defaults to False; when True, use compact dtypes (compact_frame)
+    """
+
+    # Preprocess inputs ========================
+    if spec is None:
+        spec = FilterSpec(
+            sampleid,
+            phenos,
+            tdist_filter,
+            rdist_filter,
+            all_reg,
+            excl_ln,
+            t_hist_step=t_hist_step,
+            t_hist_type=t_hist_type,
+        )
+
+    if spec.sampleid is None:
+        spec = spec.replace(sampleid=[114])
+        print(f"Defaulting to sampleid: {list(spec.sampleid)}.")
+    binned = spec.t_hist_step is not None
+
+    if database is None:
+        print("Defaulting to wsi02.")
+        database = "wsi02"
+    database = get_db(database)
+
+    if altdb is None:
+        altdb = ""
+    else:
+        altdb = f"{altdb}."
+    # ===========================================
+
+    # Query based on filters ================================================
+    cell_filt = spec.compile(cell="c", reg="r", ln="ln", pheno="p")
+    area_filt = spec.compile(cell="c", reg="r", ln="ln", pheno=None)
+
+    annos_sql = f"""
+        left join {altdb}dbo.annotations r
+            on (c.sampleid = r.sampleid and r.lname = 'regression')
+        left join {altdb}dbo.annotations ln
+            on (c.sampleid = ln.sampleid and ln.lname = 'lymph node')
+    """
+    bin_col = ", tdist_bin" if binned else ""
+
+    # Each aggregate is referenced once, so neither is evaluated twice, and
+    # both come back stacked in one result
+    sql = f"""
+    with counts as (
+        select c.sampleid, p.phenotype, c.exprphenotype{cell_filt.bin_select},
+        count(*) c
+        from {altdb}dbo.celltag c
+        left join {altdb}dbo.phenotype p
+            on c.ptype = p.ptype
+        {annos_sql}
+        {cell_filt.bin_apply}
+        where {cell_filt.where}
+        group by c.sampleid, p.phenotype, c.exprphenotype{cell_filt.bin_group}
+    ),
+    areas as (
+        select c.sampleid{area_filt.bin_select}, count(*)/{NUR} area_mm
+        from {altdb}dbo.randomcell c
+        {annos_sql}
+        {area_filt.bin_apply}
+        where {area_filt.where}
+        group by c.sampleid{area_filt.bin_group}
+    )
+    select 'counts' part, sampleid, phenotype, exprphenotype{bin_col}, c,
+    NULL area_mm
+    from counts
+    union all
+    select 'areas' part, sampleid, NULL, NULL{bin_col}, NULL, area_mm
+    from areas
+    """
+    data = cached_query(
+        database,
+        param_sql(sql, {**area_filt.params, **cell_filt.params}),
+        altdb=altdb,
+        sampleids=list(spec.sampleid),
+    )
+    # =======================================================================
+
+    # Post-process queried data =============================================
+    bins = ["tdist_bin"] if binned else []
+    is_count = data["part"] == "counts"
+    cells = data.loc[
+        is_count, ["sampleid", "phenotype", "exprphenotype", *bins, "c"]
+    ]
+    cells = cells.astype({"c": int})
+    area = data.loc[~is_count, ["sampleid", *bins, "area_mm"]]
+
+    # Zero-fill missing bins/exprphenotypes and add Total rows as
+    # get_cell_counts does, keeping only bins with area to divide by
+    cells = complete_counts(cells, spec.t_hist_step)
+    data = cells.merge(area, on=["sampleid", *bins], how="inner")
+    # =======================================================================
+
+    data["density_mm"] = data["c"] / data["area_mm"]
+
+    if compact:
+        data = compact_frame(data)
+
+    return data
@@ -0,0 +1,180 @@
+"""Fine-grained histogram cube of cell counts and randomcell area, so other
+binnings and band filters are rolled up locally instead of re-queried."""
+
+import numpy as np
+from .db_session import get_db
+from .filter_spec import FilterSpec, param_sql
+from .get_cell_counts import complete_counts
+from .get_density import NUR
+from .query_cache import cached_query
+
+
+def _cube_sql(table, altdb, where, pheno):
+    # Counts per fine tdist/rdist bin and lymph node/regression membership
+    pheno_cols = "p.phenotype, c.exprphenotype, " if pheno else ""
+    pheno_join = (
+        f"left join {altdb}dbo.phenotype p on c.ptype = p.ptype"
+        if pheno
+        else ""
+    )
+
+    return f"""
+    select c.sampleid, {pheno_cols}tb.tbin, tb.rbin, tb.in_ln, tb.in_reg,
+    count(*) c
+    from {altdb}dbo.{table} c
+    {pheno_join}
+    left join {altdb}dbo.annotations r
+        on (c.sampleid = r.sampleid and r.lname = 'regression')
+    left join {altdb}dbo.annotations ln
+        on (c.sampleid = ln.sampleid and ln.lname = 'lymph node')
+    cross apply (
+        select floor(c.tdist/@fine) tbin, floor(c.rdist/@fine) rbin,
+        case when ln.lname is not NULL and ln.ganno.STContains(c.pos) = 1
+            then 1 else 0 end in_ln,
+        case when r.lname is not NULL and r.ganno.STContains(c.pos) = 1
+            then 1 else 0 end in_reg
+    ) tb
+    where {where}
+    group by c.sampleid, {pheno_cols}tb.tbin, tb.rbin, tb.in_ln, tb.in_reg
+    """
+
+
+class HistCube:
+    """Cell counts and randomcell area per sample by fine tdist bin, fine
+    rdist bin, lymph node and regression membership (see build_cube). Rolls
+    up to get_cell_counts/get_area output for any FilterSpec whose bins are
+    multiples of the fine step. Band bounds are snapped to the fine grid:
+    a fine bin is kept when its lower edge is within [inner, outer), and
+    all_reg keeps the rdist bins up to the one containing 0, so regression
+    is rdist < fine step rather than rdist <= 0.
+    counts: sampleid, phenotype, exprphenotype, tbin, rbin, in_ln, in_reg, c
+    area: sampleid, tbin, rbin, in_ln, in_reg, c (randomcell rows)
+    fine_step: bin width in microns
+    """
+
+    def __init__(self, counts, area, fine_step):
+        self.counts = counts
+        self.area = area
+        self.fine_step = fine_step
+
+    def _spec(self, spec, filters):
+        if spec is None:
+            spec = FilterSpec(**filters)
+        if spec.sampleid is None:
+            spec = spec.replace(sampleid=self.counts["sampleid"].unique())
+        if spec.t_hist_type == "fractional reg":
+            raise ValueError("The cube has no fractional reg bins.")
+        step = spec.t_hist_step
+        if step is not None and not float(step / self.fine_step).is_integer():
+            raise ValueError(
+                f"t_hist_step must be a multiple of {self.fine_step}."
+            )
+
+        return spec
+
+    def _rollup(self, cube, spec, keys):
+        # Filter the fine bins and sum them into the requested bins
+        fine = 2 * self.fine_step
+        t_lo = cube["tbin"].to_numpy(dtype=float) * fine
+        r_lo = cube["rbin"].to_numpy(dtype=float) * fine
+
+        mask = cube["sampleid"].isin(spec.sampleid).to_numpy()
+        if spec.phenos is not None and "phenotype" in keys:
+            mask &= cube["phenotype"].isin(spec.phenos).to_numpy()
+
+        outer, inner = spec.tdist_filter
+        if outer is not None or inner is not None:
+            band = ~np.isnan(t_lo)
+            if outer is not None:
+                band &= t_lo < outer
+            if inner is not None:
+                band &= t_lo >= inner
+            if spec.all_reg:
+                # rdist <= 0, snapped to the bin containing 0
+                band |= r_lo <= 0
+            mask &= band
+
+        outer, inner = spec.rdist_filter
+        if outer is not None:
+            mask &= r_lo < outer
+        if inner is not None:
+            mask &= r_lo >= inner
+
+        if spec.excl_ln:
+            mask &= cube["in_ln"].to_numpy() == 0
+        if spec.reg_only:
+            mask &= cube["in_reg"].to_numpy() == 1
+
+        cube = cube[mask]
+        if spec.t_hist_step is not None:
+            step = 2 * spec.t_hist_step
+            t_lo = t_lo[mask]
+            cube = cube.assign(tdist_bin=np.floor(t_lo / step) * step / 2)
+            keys = [*keys, "tdist_bin"]
+
+        return cube.groupby(keys, dropna=False)["c"].sum().reset_index()
+
+    def cell_counts(self, spec=None, **filters):
+        """Rolled-up get_cell_counts output.
+        spec: FilterSpec, or its arguments as keywords (e.g. t_hist_step=50);
+            sampleid defaults to all samples in the cube
+        """
+
+        spec = self._spec(spec, filters)
+        cells = self._rollup(
+            self.counts, spec, ["sampleid", "phenotype", "exprphenotype"]
+        )
+
+        return complete_counts(cells, spec.t_hist_step)
+
+    def cell_area(self, spec=None, **filters):
+        """Rolled-up get_area output: sampleid, [tdist_bin,] area_mm.
+        spec: FilterSpec, or its arguments as keywords (e.g. t_hist_step=50);
+            sampleid defaults to all samples in the cube
+        """
+
+        spec = self._spec(spec, filters)
+        area = self._rollup(self.area, spec, ["sampleid"])
+        area["area_mm"] = area.pop("c") / NUR
+
+        return area
+
+
+def build_cube(sampleid=None, database="wsi02", altdb=None, fine_step=10):
+    """Query a HistCube for a cohort: one pass over celltag and randomcell,
+    after which any binning or band filter is a local rollup.
+    sampleid: int or list. defaults to 114
+    database: database name or pooled session from get_db
+    altdb: for referencing datatbases not directly accessible (e.g. wsi14)
+    fine_step: fine bin width in microns, defaults to 10
+    """
+
+    if sampleid is None:
+        sampleid = [114]
+        print(f"Defaulting to sampleid: {sampleid}.")
+
+    database = get_db(database)
+    altdb = "" if altdb is None else f"{altdb}."
+
+    filt = FilterSpec(sampleid).compile(cell="c")
+    # Fine step in pixels
+    params = {**filt.params, "fine": 2 * fine_step}
+    sampleids = list(FilterSpec(sampleid).sampleid)
+
+    print("Building count cube...")
+    counts = cached_query(
+        database,
+        param_sql(_cube_sql("celltag", altdb, filt.where, True), params),
+        altdb=altdb,
+        sampleids=sampleids,
+    )
+
+    print("Building area cube...")
+    area = cached_query(
+        database,
+        param_sql(_cube_sql("randomcell", altdb, filt.where, False), params),
+        altdb=altdb,
+        sampleids=sampleids,
+    )
+
+    return HistCube(counts, area, fine_step)
@@ -0,0 +1,102 @@
+"""Classify cells against annotation polygons locally, with vectorized
+prepared-geometry containment, instead of STContains on the server."""
+
+import numpy as np
+import pandas as pd
+import shapely
+from .geom_cache import get_geometries
+
+# Flag column per annotation
+FLAGS = {"tumor": "in_tumor", "regression": "in_reg", "lymph node": "in_ln"}
+
+
+def get_anno_geoms(
+    sampleid,
+    database="wsi02",
+    lnames=("tumor", "regression", "lymph node", "good tissue"),
+    altdb=None,
+):
+    """Annotation polygons as shapely geometries, one per sample/lname.
+    sampleid: int or list
+    database: database name or pooled session from get_db
+    lnames: annotations to fetch
+    altdb: for referencing datatbases not directly accessible (e.g. wsi14)
+    Returns a DataFrame of sampleid, lname, geometry
+    """
+
+    if np.isscalar(sampleid):
+        sampleid = [sampleid]
+
+    # Served from the geometry cache; uncached samples/lnames are fetched in
+    # one query
+    geoms = get_geometries(sampleid, list(lnames), database, altdb)
+    rows = [
+        (s, lname, g)
+        for lname in lnames
+        for s, g in geoms[lname].items()
+        if g is not None
+    ]
+
+    geoms = pd.DataFrame(rows, columns=["sampleid", "lname", "geometry"])
+
+    return geoms
+
+
+def tag_membership(cells, geoms):
+    """Add boolean in_tumor, in_reg and in_ln columns to cells.
+    cells: DataFrame with sampleid, px and py
+    geoms: output of get_anno_geoms
+    """
+
+    flags = {col: np.zeros(len(cells), dtype=bool) for col in FLAGS.values()}
+    x = cells["px"].to_numpy()
+    y = cells["py"].to_numpy()
+
+    lookup = {
+        (s, lname): geom
+        for s, lname, geom in zip(
+            geoms["sampleid"], geoms["lname"], geoms["geometry"]
+        )
+    }
+
+    for sample, idx in cells.groupby("sampleid").indices.items():
+        for lname, col in FLAGS.items():
+            geom = lookup.get((sample, lname))
+            if geom is None:
+                continue
+            shapely.prepare(geom)
+            flags[col][idx] = shapely.contains_xy(geom, x[idx], y[idx])
+
+    cells = cells.assign(**flags)
+
+    return cells
+
+
+def membership_mask(cells, spec, inclusive=True):
+    """Boolean mask applying a FilterSpec's tdist, lymph node and regression
+    filters to tagged cells, as array operations.
+    cells: output of tag_membership, with tdist
+    spec: FilterSpec
+    inclusive: inner tdist bound is inclusive (>=), as in get_cell_coords
+    """
+
+    mask = np.ones(len(cells), dtype=bool)
+    tdist = cells["tdist"].to_numpy()
+
+    outer, inner = spec.tdist_filter
+    band = np.ones(len(cells), dtype=bool)
+    if outer is not None:
+        band &= tdist <= outer
+    if inner is not None:
+        band &= tdist >= inner if inclusive else tdist > inner
+    if spec.all_reg:
+        band |= cells["in_reg"].to_numpy()
+    mask &= band
+
+    if spec.excl_ln:
+        mask &= ~cells["in_ln"].to_numpy()
+
+    if spec.reg_only:
+        mask &= cells["in_reg"].to_numpy()
+
+    return pd.Series(mask, index=cells.index)
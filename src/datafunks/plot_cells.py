@@ -1,5 +1,5 @@
+import numpy as np
 import pandas as pd
-from astropathdb import AstroDB
 import matplotlib.pyplot as plt
 import geopandas as gpd
 from shapely.geometry import Point
@@ -7,6 +7,8 @@ import colorcet as cc
 import holoviews as hv
 from holoviews.element.tiles import EsriImagery
 from holoviews.operation.datashader import rasterize
+from .db_session import get_db, db_name
+from .get_cell_coords import iter_cell_coords
 
 # , datashade
 # import datashader as ds
@@ -25,26 +27,36 @@ def plot_cells(
     geo=False,
     shader=False,
     save_label=False,
+    batch_size=None,
 ):
 
     if x is None and y is None:
         pheno = "CD8"
         sample = 125
-        print(f"No coords provided, querying {database}: {sample} {pheno}.")
+        print(
+            f"No coords provided, querying {db_name(database)}: "
+            f"{sample} {pheno}."
+        )
 
-        db = AstroDB(database=database)
+        if batch_size is not None:
+            # Stream the cells in batches rather than one big frame
+            batches = iter_cell_coords(
+                sample, pheno, database, batch_size=batch_size
+            )
+        else:
+            db = get_db(database)
 
-        sql = f"""
-        select ct.px, ct.py
-        from dbo.celltag ct, dbo.phenotype p
-        where ct.ptype = p.ptype
-        and p.phenotype = '{pheno}'
-        and ct.sampleid = {sample}
-        """
-        cell_coords = db.query(sql)
+            sql = f"""
+            select ct.px, ct.py
+            from dbo.celltag ct, dbo.phenotype p
+            where ct.ptype = p.ptype
+            and p.phenotype = '{pheno}'
+            and ct.sampleid = {sample}
+            """
+            cell_coords = db.query(sql)
 
-        x = cell_coords["px"]
-        y = cell_coords["py"]
+            x = cell_coords["px"]
+            y = cell_coords["py"]
 
     # Optional annotation overlay - to do
 
@@ -57,11 +69,29 @@ def plot_cells(
         )
         mpl = True
 
+    if x is None and batch_size is not None and not mpl:
+        # Only mpl can draw batch by batch
+        batches = list(batches)
+        x = np.concatenate([b["px"] for b in batches])
+        y = np.concatenate([b["py"] for b in batches])
+
     if mpl:
         plt.rcParams["font.family"] = ["Arial"]
         plt.rcParams["font.weight"] = "bold"
 
-        plt.scatter(x, y, c=colour, s=1, edgecolor="black", linewidth=0.1)
+        if x is None:
+            # Render each streamed batch as it arrives
+            for batch in batches:
+                plt.scatter(
+                    batch["px"],
+                    batch["py"],
+                    c=colour,
+                    s=1,
+                    edgecolor="black",
+                    linewidth=0.1,
+                )
+        else:
+            plt.scatter(x, y, c=colour, s=1, edgecolor="black", linewidth=0.1)
 
         plt.gca().set_aspect("equal")
         plt.gca().set_axis_off()
@@ -0,0 +1,376 @@
+"""Opt-in on-disk cache of query results, stored as compressed Parquet.
+Entries are keyed by the normalized SQL text plus the database/altdb, expire
+after a TTL and are evicted least-recently-used once the cache outgrows its
+size cap. Other funks can keep files in the cache directory under the same
+rules (see store_files). The index is only rewritten under a lock file, so
+several processes can share one cache directory. Parquet support needs
+pyarrow (pip install datafunks[cache]).
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from .db_session import db_name
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "datafunks")
+# One week
+TTL = 7 * 24 * 60 * 60
+# 5 GB
+MAX_BYTES = 5 * 1024**3
+# Cache hits only note their access time in memory; the index is rewritten
+# with the next stored result, or on a hit once the notes are this old
+ACCESS_FLUSH = 60
+# A lock file older than this (seconds) was left by a crashed process
+LOCK_STALE = 30
+
+_CONFIG = {"path": None, "ttl": TTL, "max_bytes": MAX_BYTES}
+_LOCK = threading.Lock()
+# {key: last access time} not yet written to the index
+_ACCESSED = {}
+_FLUSHED = {"at": time.time()}
+# Called as hook(database, sampleid) by invalidate_cache, so caches held
+# outside the index (e.g. in memory) are dropped along with it
+_INVALIDATE_HOOKS = []
+
+
+def enable_cache(path=None, ttl=TTL, max_bytes=MAX_BYTES):
+    """Turn on the query result cache.
+    path: cache directory, defaults to ~/.cache/datafunks
+    ttl: seconds before an entry expires; None never expires
+    max_bytes: total size cap before least-recently-used eviction
+    """
+
+    if path is None:
+        path = CACHE_DIR
+
+    os.makedirs(path, exist_ok=True)
+
+    _CONFIG.update(path=path, ttl=ttl, max_bytes=max_bytes)
+
+
+def disable_cache():
+    """Turn off the query result cache. Cached files are left on disk."""
+
+    _CONFIG["path"] = None
+
+
+def cache_path():
+    """Directory of the enabled cache, or None when caching is off."""
+
+    return _CONFIG["path"]
+
+
+def _normalize(sql):
+    # Collapse whitespace outside of quoted literals so reformatting a query
+    # doesn't change its key
+    parts = re.split(r"('[^']*')", sql)
+    parts = [
+        part if part.startswith("'") else re.sub(r"\s+", " ", part)
+        for part in parts
+    ]
+
+    return "".join(parts).strip()
+
+
+def _key(sql, database, altdb):
+    text = json.dumps([database, altdb or "", _normalize(sql)])
+
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _index_path():
+    return os.path.join(_CONFIG["path"], "index.json")
+
+
+def _entry_path(key, entry=None):
+    # Query results are key.parquet; stored files keep their own path
+    if entry is not None and "file" in entry:
+        return os.path.join(_CONFIG["path"], *entry["file"].split("/"))
+
+    return os.path.join(_CONFIG["path"], f"{key}.parquet")
+
+
+@contextmanager
+def _locked():
+    # Hold the index against other threads, then other processes sharing
+    # the directory, for a load-modify-save
+    with _LOCK:
+        lock = f"{_index_path()}.lock"
+        while True:
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock) > LOCK_STALE:
+                        os.remove(lock)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(lock)
+
+
+def _load_index():
+    try:
+        with open(_index_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, PermissionError):
+        # PermissionError: Windows, mid-swap by another process
+        return {}
+
+
+def _save_index(index):
+    # Only called under _locked(); the swap means lock-free readers always
+    # see a whole index
+    tmp = f"{_index_path()}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    for attempt in range(50):
+        try:
+            os.replace(tmp, _index_path())
+            break
+        except PermissionError:
+            # Windows: a reader has the index open
+            if attempt == 49:
+                raise
+            time.sleep(0.01)
+
+
+def _merge_accessed(index):
+    # Fold the noted access times into the index before it is saved
+    for key, accessed in _ACCESSED.items():
+        if key in index:
+            index[key]["accessed"] = max(index[key]["accessed"], accessed)
+    _ACCESSED.clear()
+    _FLUSHED["at"] = time.time()
+
+
+def _drop(index, key):
+    entry = index.pop(key, None)
+    try:
+        os.remove(_entry_path(key, entry))
+    except FileNotFoundError:
+        pass
+
+
+def _fresh(entry):
+    return entry is not None and (
+        _CONFIG["ttl"] is None
+        or time.time() - entry["created"] <= _CONFIG["ttl"]
+    )
+
+
+def _sampleid_set(sampleids):
+    if np.isscalar(sampleids):
+        sampleids = [sampleids]
+
+    return sorted({str(x) for x in sampleids})
+
+
+def _evict(index):
+    # Expired entries first, then least recently used until under the cap
+    now = time.time()
+    if _CONFIG["ttl"] is not None:
+        for key, entry in list(index.items()):
+            if now - entry["created"] > _CONFIG["ttl"]:
+                _drop(index, key)
+
+    total = sum(entry["bytes"] for entry in index.values())
+    for key in sorted(index, key=lambda k: index[k]["accessed"]):
+        if total <= _CONFIG["max_bytes"]:
+            break
+        total -= index[key]["bytes"]
+        _drop(index, key)
+
+
+def cached_query(database, sql, altdb=None, sampleids=None):
+    """Run database.query(sql), reusing a cached result when enabled.
+    database: pooled session or AstroDB object
+    sql: query text
+    altdb: alternative database prefix referenced in sql (e.g. wsi14.)
+    sampleids: sampleids the query is restricted to, for invalidate_cache.
+        Defaults to None, i.e. the query may touch any sample
+    """
+
+    name = db_name(database)
+
+    # Can't key results safely without knowing which database they're from
+    if _CONFIG["path"] is None or name is None:
+        return database.query(sql)
+
+    key = _key(sql, name, altdb)
+    path = _entry_path(key)
+
+    with _LOCK:
+        hit = _fresh(_load_index().get(key)) and os.path.exists(path)
+        if hit:
+            _ACCESSED[key] = time.time()
+        flush = hit and time.time() - _FLUSHED["at"] >= ACCESS_FLUSH
+    if flush:
+        with _locked():
+            index = _load_index()
+            _merge_accessed(index)
+            _save_index(index)
+    if hit:
+        return pd.read_parquet(path)
+
+    result = database.query(sql)
+
+    if sampleids is not None:
+        sampleids = _sampleid_set(sampleids)
+
+    # Write then swap so other readers of the cache never see a partial file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        result.to_parquet(tmp, compression="zstd", index=False)
+    except (ImportError, ValueError, TypeError) as err:
+        print(f"Query result not cached: {err}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return result
+    os.replace(tmp, path)
+
+    with _locked():
+        index = _load_index()
+        now = time.time()
+        index[key] = {
+            "database": name,
+            "altdb": (altdb or "").rstrip("."),
+            "sampleids": sampleids,
+            "created": now,
+            "accessed": now,
+            "bytes": os.path.getsize(path),
+        }
+        _merge_accessed(index)
+        _evict(index)
+        _save_index(index)
+
+    return result
+
+
+def store_files(files, database, altdb=None, kind=None):
+    """Track files already written to the cache directory, so they expire,
+    count towards max_bytes and are removed by invalidate_cache like query
+    results. The index is updated once for the whole batch. Does nothing
+    while caching is off.
+    files: {path relative to cache_path(), with / separators: sampleids the
+        file covers, None for any}
+    database: database name the files' data comes from
+    altdb: alternative database name, if any
+    kind: label for invalidate_cache, e.g. "geoms"
+    """
+
+    if _CONFIG["path"] is None or not files:
+        return
+
+    with _locked():
+        index = _load_index()
+        now = time.time()
+        for file, sampleids in files.items():
+            index[file] = {
+                "database": database,
+                "altdb": (altdb or "").rstrip("."),
+                "sampleids": (
+                    None if sampleids is None else _sampleid_set(sampleids)
+                ),
+                "created": now,
+                "accessed": now,
+                "bytes": os.path.getsize(_entry_path(file, {"file": file})),
+                "file": file,
+                "kind": kind,
+            }
+        _merge_accessed(index)
+        _evict(index)
+        _save_index(index)
+
+
+def store_file(file, database, altdb=None, sampleids=None, kind=None):
+    """Single-file store_files.
+    sampleids: sampleids the file covers; None for any
+    """
+
+    store_files({file: sampleids}, database, altdb, kind)
+
+
+def cached_files(files):
+    """Which files stored with store_files are still cached and fresh,
+    reading the index once. Notes their access for LRU eviction.
+    files: paths relative to cache_path(), with / separators
+    Returns the set of fresh files
+    """
+
+    if _CONFIG["path"] is None or not files:
+        return set()
+
+    with _LOCK:
+        index = _load_index()
+        fresh = {file for file in files if _fresh(index.get(file))}
+        now = time.time()
+        for file in fresh:
+            _ACCESSED[file] = now
+
+    return fresh
+
+
+def cached_file(file):
+    """Single-file cached_files: whether file is still cached and fresh."""
+
+    return file in cached_files([file])
+
+
+def on_invalidate(hook):
+    """Register hook(database, sampleid) to run on every invalidate_cache,
+    e.g. to clear an in-memory cache. database is a name or None.
+    """
+
+    _INVALIDATE_HOOKS.append(hook)
+
+
+def invalidate_cache(database=None, sampleid=None, kind=None):
+    """Remove cached results, stored files and (via on_invalidate hooks)
+    in-memory caches built from them.
+    database: only entries from this database (or altdb); defaults to all
+    sampleid: int or list; only entries that may cover these samples
+    kind: only stored files of this kind (see store_files), e.g. "geoms";
+        defaults to everything
+    """
+
+    database = db_name(database)
+
+    for hook in _INVALIDATE_HOOKS:
+        hook(database, sampleid)
+
+    if _CONFIG["path"] is None:
+        return
+
+    if sampleid is not None:
+        sampleid = set(_sampleid_set(sampleid))
+
+    with _locked():
+        index = _load_index()
+        for key, entry in list(index.items()):
+            if kind is not None and entry.get("kind") != kind:
+                continue
+            if database is not None and database not in (
+                entry["database"],
+                entry["altdb"],
+            ):
+                continue
+            covered = entry["sampleids"]
+            if sampleid is not None and covered is not None:
+                if not sampleid & set(covered):
+                    continue
+            _drop(index, key)
+        _merge_accessed(index)
+        _save_index(index)
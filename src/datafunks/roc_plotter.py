@@ -1,12 +1,16 @@
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-from scipy.stats import percentileofscore
 import matplotlib.pyplot as plt
 
 
+# np.trapz is np.trapezoid from numpy 2.0 on, and later removed
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+
 def auc_grabber(x, y):
     # Calculate area from ordered x (fpr) and y (tpr) points
-    auc = abs(round(np.trapz(y=y, x=x), 3))
+    auc = abs(round(_trapezoid(y=y, x=x), 3))
 
     return auc
 
@@ -19,57 +23,50 @@ def threshold_grabber(thresh_vals, outcome_vals, true_labels=None):
             lambda x: "High" if x >= outcome_threshold else "Low"
         )
 
-    # Combine values into df for easy sorting
-    df = (
-        pd.DataFrame(
-            {
-                "thresh_vals": thresh_vals,
-                "outcome_vals": outcome_vals,
-                "true_labels": true_labels,
-            }
-        )
-        .sort_values("thresh_vals")
-        .reset_index(drop=True)
+    # Combine values into df to align them
+    df = pd.DataFrame(
+        {
+            "thresh_vals": thresh_vals,
+            "outcome_vals": outcome_vals,
+            "true_labels": true_labels,
+        }
     )
+    vals = df["thresh_vals"].to_numpy(dtype=float)
+    labels = df["true_labels"].to_numpy()
 
-    # Get threshold before, after, and in between each value by list compin'
-    thresholds = sorted(
-        list(
-            set(
-                [
-                    x - 1 if idx == 0 else (x + df["thresh_vals"][idx - 1]) / 2
-                    for idx, x in enumerate(
-                        [*df["thresh_vals"], max(df["thresh_vals"]) + 1]
-                    )
-                ]
-            )
+    # Sort once; thresholds before, after, and in between each value
+    sorted_vals = np.sort(vals)
+    thresholds = np.unique(
+        np.concatenate(
+            [
+                sorted_vals[:1] - 1,
+                (sorted_vals[1:] + sorted_vals[:-1]) / 2,
+                sorted_vals[-1:] + 0.5,
+            ]
         )
     )
 
-    # Calculate False Positive Rate and True Positive Rate at each threhold
-    fpr_list = []
-    tpr_list = []
-    for t in thresholds:
-        fpr = len(
-            df[(df["thresh_vals"] >= t) & (df["true_labels"] == "Low")]
-        ) / len(df[df["true_labels"] == "Low"])
-        tpr = len(
-            df[(df["thresh_vals"] >= t) & (df["true_labels"] == "High")]
-        ) / len(df[df["true_labels"] == "High"])
-        fpr_list.append(fpr)
-        tpr_list.append(tpr)
+    # Calculate False Positive Rate and True Positive Rate at each threhold,
+    # counting values >= threshold by binary search on each sorted class
+    def rate(label):
+        class_vals = np.sort(vals[labels == label])
+        above = len(class_vals) - np.searchsorted(class_vals, thresholds)
+        return above / len(class_vals)
+
+    fpr_list = rate("Low")
+    tpr_list = rate("High")
 
     # Calculate auc from tpr and fpr
     auc = auc_grabber(x=fpr_list, y=tpr_list)
 
     # Calculate Youden Index
-    youden_idx = [tpr - fpr for tpr, fpr in zip(tpr_list, fpr_list)]
+    youden_idx = tpr_list - fpr_list
 
-    # Calculate quantiles of dataset for each threshold
-    quantiles = [
-        percentileofscore(df["thresh_vals"], thresh, kind="rank")
-        for thresh in thresholds
-    ]
+    # Calculate quantiles of dataset for each threshold, as
+    # percentileofscore(kind="rank") does
+    left = np.searchsorted(sorted_vals, thresholds, side="left")
+    right = np.searchsorted(sorted_vals, thresholds, side="right")
+    quantiles = (left + right + (right > left)) * 50.0 / len(sorted_vals)
 
     thresh_df = pd.DataFrame(
         {
@@ -85,6 +82,212 @@ def threshold_grabber(thresh_vals, outcome_vals, true_labels=None):
     return thresh_df
 
 
+def _roc_matrix(vals, high, low=None):
+    # ROC of every row at once: vals and high/low (bool labels, low defaults
+    # to ~high) are (rows, n); entries in neither class, e.g. NaN vals, are
+    # ignored. Returns fpr and tpr at each descending value (tied values
+    # share the point at the end of their run), auc, max Youden index and
+    # its threshold
+    if low is None:
+        low = ~high
+    n = vals.shape[1]
+    order = np.argsort(-vals, axis=1, kind="stable")
+    vals = np.take_along_axis(vals, order, axis=1)
+    high = np.take_along_axis(high, order, axis=1)
+    low = np.take_along_axis(low, order, axis=1)
+
+    # Last position of each run of tied values, back-filled across the run
+    end = np.ones(vals.shape, dtype=bool)
+    end[:, :-1] = vals[:, 1:] != vals[:, :-1]
+    run_end = np.where(end, np.arange(n), n)
+    run_end = np.minimum.accumulate(run_end[:, ::-1], axis=1)[:, ::-1]
+
+    tp = np.take_along_axis(np.cumsum(high, axis=1), run_end, axis=1)
+    fp = np.take_along_axis(np.cumsum(low, axis=1), run_end, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tpr = tp / tp[:, -1:]
+        fpr = fp / fp[:, -1:]
+
+    # Trapezoids from (0, 0); ties become diagonal steps, as in
+    # threshold_grabber
+    zeros = np.zeros((len(vals), 1))
+    x = np.hstack([zeros, fpr])
+    y = np.hstack([zeros, tpr])
+    auc = ((x[:, 1:] - x[:, :-1]) * (y[:, 1:] + y[:, :-1]) / 2).sum(axis=1)
+
+    # Threshold halfway to the next lower value (1 below the minimum); the
+    # highest threshold wins ties for the max Youden index. Ties are found
+    # on the exact integer tp * n_low - fp * n_high, as the float rates can
+    # differ in the last bit for equal Youden indices
+    score = tp * fp[:, -1:] - fp * tp[:, -1:]
+    score = np.where(end & ~np.isnan(vals), score, np.iinfo(score.dtype).min)
+    best = np.argmax(score, axis=1)[:, None]
+    youden = np.where(end & ~np.isnan(vals), tpr - fpr, -np.inf)
+    lower = np.hstack([vals[:, 1:], vals[:, -1:]])
+    lower = np.where(np.isnan(lower) | (lower == vals), vals - 2, lower)
+    threshold = (vals + lower) / 2
+
+    youden = np.take_along_axis(youden, best, axis=1)[:, 0]
+    youden[np.isinf(youden)] = np.nan
+
+    return (
+        fpr,
+        tpr,
+        auc,
+        youden,
+        np.take_along_axis(threshold, best, axis=1)[:, 0],
+    )
+
+
+def _boot_chunk(args):
+    # auc, Youden index and threshold for one chunk of resamples
+    vals, high, seed, size = args
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(vals), (size, len(vals)))
+    _, _, auc, youden, threshold = _roc_matrix(vals[idx], high[idx])
+
+    return auc, youden, threshold
+
+
+def bootstrap_roc(
+    thresh_vals,
+    outcome_vals=None,
+    true_labels=None,
+    n_boot=2000,
+    ci=0.95,
+    seed=None,
+    chunk_size=100,
+    n_jobs=1,
+    return_samples=False,
+):
+    """Bootstrap confidence intervals for the AUC, the max Youden index and
+    its threshold. Resamples are drawn as index matrices and scored in
+    vectorized chunks.
+    thresh_vals: scores
+    outcome_vals: labelled High/Low by median, as in threshold_grabber
+    true_labels: High/Low labels; overrides outcome_vals
+    n_boot: number of resamples, defaults to 2000
+    ci: interval width, defaults to 0.95
+    seed: for reproducible resamples
+    chunk_size: resamples scored at once; lower it for long score vectors
+    n_jobs: processes to score chunks on, defaults to 1
+    return_samples: defaults to False; when True, also return the
+        per-resample values
+    Returns a DataFrame of estimate, lower and upper for auc, Youden_idx and
+    threshold
+    """
+
+    # Label outcome as High or Low according to median by default
+    if true_labels is None:
+        outcome_threshold = outcome_vals.median()
+        true_labels = outcome_vals.apply(
+            lambda x: "High" if x >= outcome_threshold else "Low"
+        )
+
+    df = pd.DataFrame({"thresh_vals": thresh_vals, "true_labels": true_labels})
+    df = df[df["true_labels"].isin(["High", "Low"])]
+    vals = df["thresh_vals"].to_numpy(dtype=float)
+    high = (df["true_labels"] == "High").to_numpy()
+
+    _, _, auc, youden, threshold = _roc_matrix(vals[None], high[None])
+
+    # One seed per chunk, so results don't depend on n_jobs
+    sizes = [
+        min(chunk_size, n_boot - start)
+        for start in range(0, n_boot, chunk_size)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(vals, high, s, size) for s, size in zip(seeds, sizes)]
+
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            chunks = list(pool.map(_boot_chunk, tasks))
+    else:
+        chunks = [_boot_chunk(task) for task in tasks]
+
+    samples = pd.DataFrame(
+        {
+            "auc": np.concatenate([c[0] for c in chunks]),
+            "Youden_idx": np.concatenate([c[1] for c in chunks]),
+            "threshold": np.concatenate([c[2] for c in chunks]),
+        }
+    )
+
+    # Resamples missing a class have no ROC
+    alpha = (1 - ci) / 2
+    summary = pd.DataFrame(
+        {
+            "estimate": [auc[0], youden[0], threshold[0]],
+            "lower": samples.quantile(alpha).to_numpy(),
+            "upper": samples.quantile(1 - alpha).to_numpy(),
+        },
+        index=samples.columns,
+    )
+
+    if return_samples:
+        return summary, samples
+
+    return summary
+
+
+def _by_row(values, features):
+    # Series are aligned by index later; arrays and lists go by position
+    if isinstance(values, pd.Series):
+        return values
+
+    values = np.asarray(values)
+    if len(values) != len(features):
+        raise ValueError(
+            f"Got {len(values)} values for {len(features)} rows of features."
+        )
+
+    return pd.Series(values, index=features.index)
+
+
+def batch_roc(features, outcome_vals=None, true_labels=None):
+    """ROC summary of many candidate markers against one outcome in a single
+    vectorized pass, e.g. phenotype densities pivoted to one column each.
+    features: DataFrame of samples x features; NaNs are left out per feature
+    outcome_vals: labelled High/Low by median, as in threshold_grabber
+    true_labels: High/Low labels; overrides outcome_vals
+    Series are aligned to features by index; arrays and lists must have
+    one value per row of features
+    Returns feature, n_high, n_low, auc, Youden_idx and threshold (values >=
+    threshold called High), ranked by auc; auc < 0.5 marks features that are
+    lower in the High group
+    """
+
+    # Label outcome as High or Low according to median by default
+    if true_labels is None:
+        outcome_vals = _by_row(outcome_vals, features)
+        outcome_threshold = outcome_vals.median()
+        true_labels = outcome_vals.apply(
+            lambda x: "High" if x >= outcome_threshold else "Low"
+        )
+
+    labels = _by_row(true_labels, features).reindex(features.index)
+    labels = labels.to_numpy()
+    vals = features.to_numpy(dtype=float).T
+    valid = ~np.isnan(vals)
+    high = (labels == "High") & valid
+    low = (labels == "Low") & valid
+
+    _, _, auc, youden, threshold = _roc_matrix(vals, high, low)
+
+    ranking = pd.DataFrame(
+        {
+            "feature": features.columns,
+            "n_high": high.sum(axis=1),
+            "n_low": low.sum(axis=1),
+            "auc": auc,
+            "Youden_idx": youden,
+            "threshold": threshold,
+        }
+    )
+
+    return ranking.sort_values("auc", ascending=False).reset_index(drop=True)
+
+
 def roc_plotter(
     thresh_vals=None,
     outcome_vals=None,
@@ -93,7 +296,12 @@ def roc_plotter(
     colour="blue",
     youden=False,
     save=True,
+    bootstrap=None,
 ):
+    """Plot the ROC curve of thresh_vals for High/Low outcome.
+    bootstrap: number of resamples for 95% CIs on the AUC (and the Youden
+        threshold, if youden), e.g. 2000; defaults to None for no CIs
+    """
 
     thresh_df = threshold_grabber(thresh_vals, outcome_vals, true_labels)
 
@@ -101,6 +309,11 @@ def roc_plotter(
     tpr_list = thresh_df["tpr"]
     auc = thresh_df["auc"][0]
 
+    if bootstrap:
+        boot = bootstrap_roc(
+            thresh_vals, outcome_vals, true_labels, n_boot=bootstrap
+        )
+
     plt.clf()
     plt.cla()
 
@@ -155,7 +368,19 @@ def roc_plotter(
     plt.xlim([0, 1])
     plt.ylim([0, 1])
 
-    plt.text(x=0.60, y=0.2, s=f"AUC = {auc}")
+    if bootstrap:
+        lower, upper = boot.loc["auc", ["lower", "upper"]].round(3)
+        plt.text(x=0.60, y=0.2, s=f"AUC = {auc} ({lower}-{upper})")
+        if youden:
+            lower, upper = boot.loc["threshold", ["lower", "upper"]]
+            plt.text(
+                x=0.60,
+                y=0.10,
+                s=f"Cutpoint 95% CI: {lower:.3g}-{upper:.3g}",
+                va="center",
+            )
+    else:
+        plt.text(x=0.60, y=0.2, s=f"AUC = {auc}")
 
     # Graphpad-ify
     plt.rcParams["font.family"] = ["Arial"]
@@ -0,0 +1,83 @@
+"""LOWESS smoothing of binned curves, all groups in one pass."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from statsmodels.nonparametric.smoothers_lowess import lowess
+
+# Points in each smoothed curve
+GRID = 1000
+
+
+def _fit(args):
+    # One group's LOWESS fit, interpolated onto an evenly spaced grid
+    tdist, y_vals, frac = args
+    loess_result = lowess(y_vals, tdist, frac=frac)
+    xl = np.linspace(min(tdist), max(tdist), GRID)
+
+    return xl, np.interp(xl, loess_result[:, 0], loess_result[:, 1])
+
+
+def _fit_all(tasks, n_jobs):
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs > 1 and len(tasks) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                chunksize = max(1, len(tasks) // (4 * n_jobs))
+                return list(pool.map(_fit, tasks, chunksize=chunksize))
+        except (OSError, RuntimeError):
+            # No worker processes available here (e.g. a frozen or
+            # restricted interpreter); fit in this process instead
+            pass
+
+    return [_fit(task) for task in tasks]
+
+
+def smooth_groups(data, group_cols, y_col, t_hist_step, frac=0.15, n_jobs=1):
+    """LOWESS-smooth y_col over tdist_bin for every group, interpolated onto
+    1000 points per group. Each point carries the row of its group whose
+    tdist_bin it falls in (NaN where the group has no such bin), plus
+    tdist_smoothed and smoothed_y, as one long frame.
+    data: DataFrame with tdist_bin, group_cols and y_col
+    group_cols: columns identifying a curve, e.g. ["sampleid", "phenotype"]
+    y_col: column to smooth
+    t_hist_step: tdist bin width
+    frac: LOWESS span, defaults to 0.15
+    n_jobs: processes for the fits, defaults to 1 (in this process), as each
+        fit is tiny next to starting workers; None uses all cores
+    """
+
+    data = data.reset_index(drop=True)
+    tdist = data["tdist_bin"].to_numpy()
+    y_vals = data[y_col].to_numpy()
+
+    groups = list(data.groupby(group_cols).indices.values())
+    if not groups:
+        return data.iloc[:0].assign(tdist_smoothed=[], smoothed_y=[])
+
+    tasks = [(tdist[idx], y_vals[idx], frac) for idx in groups]
+    fits = _fit_all(tasks, n_jobs)
+
+    # Row of the group at each smoothed point, found by bin lookup
+    rows, xls, smoothed_ys, bins = [], [], [], []
+    for idx, (xl, smoothed_y) in zip(groups, fits):
+        grid_bins = (np.floor(xl / t_hist_step) * t_hist_step).astype(int)
+
+        order = np.argsort(tdist[idx], kind="stable")
+        group_bins = tdist[idx][order]
+        pos = np.searchsorted(group_bins, grid_bins).clip(max=len(idx) - 1)
+        found = group_bins[pos] == grid_bins
+
+        rows.append(np.where(found, idx[order][pos], -1))
+        xls.append(xl)
+        smoothed_ys.append(smoothed_y)
+        bins.append(grid_bins)
+
+    # Rows of -1 aren't in the index, so reindex leaves them NaN
+    smoothed = data.reindex(np.concatenate(rows)).reset_index(drop=True)
+    smoothed["tdist_bin"] = np.concatenate(bins)
+    smoothed["tdist_smoothed"] = np.concatenate(xls)
+    smoothed["smoothed_y"] = np.concatenate(smoothed_ys)
+
+    return smoothed
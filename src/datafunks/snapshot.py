@@ -0,0 +1,201 @@
+"""Snapshot celltag, randomcell, phenotype and annotations for a cohort into
+a local Parquet dataset partitioned by database and sampleid, e.g.
+path/celltag/database=wsi02/sampleid=114/part-0.parquet
+Needs pyarrow (pip install datafunks[cache]).
+"""
+
+import argparse
+import json
+import os
+import pandas as pd
+from .db_session import get_db, db_name
+
+TABLES = ["celltag", "randomcell", "phenotype", "annotations"]
+
+# Columns pulled per sample, and what to checksum to detect changed samples
+_SAMPLE_SQL = {
+    "celltag": (
+        "ct.ptype, ct.exprphenotype, ct.tdist, ct.rdist, ct.px, ct.py",
+        "ct.ptype, ct.exprphenotype, ct.tdist, ct.rdist, ct.px, ct.py",
+        "dbo.celltag ct",
+        "ct",
+    ),
+    "randomcell": (
+        "c.tdist, c.rdist, c.pos.STX px, c.pos.STY py",
+        "c.tdist, c.rdist, c.pos.STX, c.pos.STY",
+        "dbo.randomcell c",
+        "c",
+    ),
+    "annotations": (
+        "a.lname, a.ganno.STAsBinary() wkb",
+        "a.lname, a.ganno.STArea(), a.ganno.STNumPoints()",
+        "dbo.annotations a",
+        "a",
+    ),
+}
+
+
+def _manifest_path(path, database):
+    return os.path.join(path, f"_manifest_{database}.json")
+
+
+def _load_manifest(path, database):
+    try:
+        with open(_manifest_path(path, database), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_manifest(manifest, path, database):
+    tmp = f"{_manifest_path(path, database)}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, _manifest_path(path, database))
+
+
+def _write(df, directory):
+    os.makedirs(directory, exist_ok=True)
+    file = os.path.join(directory, "part-0.parquet")
+    # Write then swap so an interrupted sync never leaves a partial file
+    # (dot-prefixed files are skipped when the dataset is read)
+    tmp = os.path.join(directory, ".part-0.parquet.tmp")
+    df.to_parquet(tmp, compression="zstd", index=False)
+    os.replace(tmp, file)
+
+
+def _fingerprints(db, table, sampleid, altdb):
+    _, checksum_cols, from_sql, alias = _SAMPLE_SQL[table]
+    sql = f"""
+    select {alias}.sampleid, count(*) n,
+        checksum_agg(binary_checksum({checksum_cols})) chk
+    from {altdb}{from_sql}
+    where {alias}.sampleid in ({",".join(map(str, sampleid))})
+    group by {alias}.sampleid
+    """
+    prints = db.query(sql)
+
+    return {
+        str(s): f"{n}:{chk}"
+        for s, n, chk in zip(prints["sampleid"], prints["n"], prints["chk"])
+    }
+
+
+def snapshot_cohort(
+    sampleid,
+    database="wsi02",
+    path="snapshot",
+    tables=None,
+    incremental=True,
+    altdb=None,
+):
+    """Pull a cohort's tables into a local, partitioned Parquet dataset.
+    sampleid: int or list
+    database: database name or pooled session, defaults to wsi02
+    path: root directory of the dataset
+    tables: any of celltag, randomcell, phenotype, annotations; defaults to all
+    incremental: defaults to True; only fetch samples that are new or whose
+        row count/checksum changed since the last snapshot
+    altdb: for referencing datatbases not directly accessible (e.g. wsi14)
+    Returns {table: [sampleids fetched]}
+    """
+
+    if not isinstance(sampleid, list):
+        sampleid = [sampleid]
+
+    if tables is None:
+        tables = TABLES
+    elif isinstance(tables, str):
+        tables = [tables]
+
+    db = get_db(database)
+    # Partition on the database the data actually comes from
+    name = altdb if altdb is not None else db_name(db)
+    altdb = "" if altdb is None else f"{altdb}."
+
+    manifest = _load_manifest(path, name)
+    fetched = {}
+
+    if "phenotype" in tables:
+        # Small lookup table, always refreshed
+        phenos = db.query(f"select ptype, phenotype from {altdb}dbo.phenotype")
+        _write(phenos, os.path.join(path, "phenotype", f"database={name}"))
+        fetched["phenotype"] = []
+
+    for table in [t for t in tables if t in _SAMPLE_SQL]:
+        cols, _, from_sql, alias = _SAMPLE_SQL[table]
+        current = _fingerprints(db, table, sampleid, altdb)
+        previous = manifest.setdefault(table, {})
+
+        todo = [
+            s
+            for s in sampleid
+            if str(s) in current
+            and not (incremental and previous.get(str(s)) == current[str(s)])
+        ]
+        print(f"{table}: fetching {len(todo)} of {len(sampleid)} samples.")
+
+        for s in todo:
+            sql = f"""
+            select {cols}
+            from {altdb}{from_sql}
+            where {alias}.sampleid = {s}
+            """
+            _write(
+                db.query(sql),
+                os.path.join(path, table, f"database={name}", f"sampleid={s}"),
+            )
+            previous[str(s)] = current[str(s)]
+            _save_manifest(manifest, path, name)
+
+        fetched[table] = todo
+
+    return fetched
+
+
+def read_snapshot(path, table, database=None, sampleid=None, columns=None):
+    """Read a table back from a snapshot as a DataFrame.
+    path: root directory of the dataset
+    table: celltag, randomcell, phenotype or annotations
+    database: defaults to all in the snapshot
+    sampleid: int or list, defaults to all in the snapshot
+    columns: defaults to all
+    """
+
+    filters = []
+    if database is not None:
+        filters.append(("database", "==", database))
+    if sampleid is not None:
+        if not isinstance(sampleid, list):
+            sampleid = [sampleid]
+        filters.append(("sampleid", "in", sampleid))
+
+    return pd.read_parquet(
+        os.path.join(path, table),
+        columns=columns,
+        filters=filters or None,
+    )
+
+
+def main(argv=None):
+    """Command line entry point: datafunks-snapshot wsi02 114 115 ..."""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database")
+    parser.add_argument("sampleid", nargs="+", type=int)
+    parser.add_argument("--path", default="snapshot")
+    parser.add_argument("--tables", nargs="+", choices=TABLES)
+    parser.add_argument("--altdb")
+    parser.add_argument(
+        "--full", action="store_true", help="refetch unchanged samples"
+    )
+    args = parser.parse_args(argv)
+
+    snapshot_cohort(
+        args.sampleid,
+        args.database,
+        args.path,
+        tables=args.tables,
+        incremental=not args.full,
+        altdb=args.altdb,
+    )
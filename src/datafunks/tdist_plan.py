@@ -0,0 +1,230 @@
+"""Lazy tdistogram: a source query plus a chain of steps, run on .collect()
+with every intermediate result memoized."""
+
+import pandas as pd
+from .filter_spec import FilterSpec
+from .get_area import get_area
+from .get_cell_counts import get_cell_counts
+from .get_density import get_density
+from .smoothing import smooth_groups
+
+# Step functions take a frame and return a new one, never changing their
+# input, since it may be a memoized result shared with other plans
+# ============================================================================
+
+
+def _fetch(spec, database, altdb, area_engine):
+    # Get counts and area in one batch
+    print("Counting cells and area...")
+    if area_engine == "exact":
+        # Area is measured locally, so only the counts come from the server
+        cells = get_cell_counts(database=database, altdb=altdb, spec=spec)
+        area = get_area(
+            database=database, altdb=altdb, spec=spec, engine="exact"
+        )
+        on = ["sampleid"]
+        if spec.t_hist_step is not None:
+            on.append("tdist_bin")
+        data = pd.merge(cells, area, on=on, how="inner")
+    else:
+        data = get_density(database=database, altdb=altdb, spec=spec)
+
+    # Cells are assigned a dist of 32700+ when annotation absent, exclude
+    # cells = cells[cells["dist_bin_um"] != 16350]
+
+    if spec.t_hist_step is None:
+        data["tdist_bin"] = "None"
+
+    return data
+
+
+def _aggregate(data, samplewise):
+    # Per sample, or pooled across samples
+    if samplewise:
+        return data.copy()
+
+    return (
+        data.groupby(["phenotype", "exprphenotype", "tdist_bin"])[
+            ["c", "area_mm"]
+        ]
+        .sum()
+        .reset_index()
+    )
+
+
+def _density(data):
+    data = data.assign(density_mm=data["c"] / data["area_mm"])
+
+    # Exclude bins with 0.4mm^2 or less area
+    return data[data["area_mm"] > 0.4**2].reset_index(drop=True)
+
+
+def _prop(data):
+    # Calculate proportion of each phenotype per sample (or pooled): sum the
+    # non-Total counts per bin in one masked pass, then divide
+    bins = ["sampleid", "tdist_bin"] if "sampleid" in data else ["tdist_bin"]
+
+    counted = data["c"].where(data["exprphenotype"] != "Total", 0)
+    grouped_c = counted.groupby([data[col] for col in bins]).transform("sum")
+
+    return data.assign(grouped_c=grouped_c, prop=data["c"] / grouped_c)
+
+
+def _prob(data):
+    # Calculate overall density per expr, per pheno (per sample if
+    # samplewise), broadcast back to every bin
+    groups = ["phenotype", "exprphenotype"]
+    if "sampleid" in data:
+        groups = ["sampleid", *groups]
+
+    grouped = data.groupby(groups)
+    grouped_den = grouped["c"].transform("sum") / grouped["area_mm"].transform(
+        "sum"
+    )
+
+    prob = data["density_mm"] / grouped_den
+
+    # Normalize before smoothing
+    return data.assign(grouped_den=grouped_den, prob=prob / prob.sum())
+
+
+def _smooth(data, t_hist_step, frac, n_jobs):
+    # Smooth the most derived y vals: prob, then prop, then density
+    groups = ["phenotype", "exprphenotype"]
+    if "sampleid" in data:
+        groups = ["sampleid", *groups]
+    y_col = next(c for c in ("prob", "prop", "density_mm") if c in data)
+
+    return smooth_groups(data, groups, y_col, t_hist_step, frac, n_jobs)
+
+
+STEPS = {
+    "aggregate": _aggregate,
+    "density": _density,
+    "prop": _prop,
+    "prob": _prob,
+    "smooth": _smooth,
+}
+# ============================================================================
+
+
+class TdistPlan:
+    """Deferred tdistogram. Each method returns a new plan with one more
+    step; nothing runs until .collect(). Plans derived from one another
+    share a memo, so re-collecting with a step toggled only runs what
+    changed, e.g.
+
+        plan = tdistogram(sampleid, "wsi02", lazy=True)
+        plan.collect()
+        plan.options(prob=True).collect()  # reuses counts and density
+
+    source: (FilterSpec, database, altdb, area_engine) to fetch
+    steps: tuple of (step name, tuple of (param, value))
+    memo: {(source, steps): DataFrame}
+    """
+
+    def __init__(self, source, steps=(), memo=None):
+        self.source = source
+        self.steps = steps
+        self.memo = {} if memo is None else memo
+
+    def _then(self, name, **params):
+        step = (name, tuple(sorted(params.items())))
+        return TdistPlan(self.source, self.steps + (step,), self.memo)
+
+    def aggregate(self, samplewise=True):
+        """Keep bins per sample, or pool counts and area across samples."""
+        return self._then("aggregate", samplewise=samplewise)
+
+    def density(self):
+        """Add density_mm and drop bins with 0.4mm^2 or less area."""
+        return self._then("density")
+
+    def prop(self):
+        """Add prop, each phenotype's share of its bin's cells."""
+        return self._then("prop")
+
+    def prob(self):
+        """Add prob, density relative to overall density, normalized."""
+        return self._then("prob")
+
+    def smooth(self, frac=0.15, n_jobs=1):
+        """LOWESS-smooth the latest y vals (see smooth_groups)."""
+        t_hist_step = self.source[0].t_hist_step
+        return self._then(
+            "smooth", t_hist_step=t_hist_step, frac=frac, n_jobs=n_jobs
+        )
+
+    def options(
+        self,
+        prob=False,
+        samplewise=True,
+        smoothed=True,
+        prop=False,
+        n_jobs=1,
+    ):
+        """Plan of the tdistogram steps for these flags, from this source."""
+
+        plan = TdistPlan(self.source, memo=self.memo)
+        plan = plan.aggregate(samplewise).density()
+        if prop:
+            plan = plan.prop()
+        if prob:
+            plan = plan.prob()
+        if smoothed:
+            plan = plan.smooth(n_jobs=n_jobs)
+
+        return plan
+
+    def collect(self):
+        """Run the plan, resuming from the longest memoized prefix."""
+
+        done = len(self.steps)
+        while done >= 0 and (self.source, self.steps[:done]) not in self.memo:
+            done -= 1
+
+        if done < 0:
+            data = _fetch(*self.source)
+            self.memo[(self.source, ())] = data
+            done = 0
+        else:
+            data = self.memo[(self.source, self.steps[:done])]
+
+        for i in range(done, len(self.steps)):
+            name, params = self.steps[i]
+            data = STEPS[name](data, **dict(params))
+            self.memo[(self.source, self.steps[: i + 1])] = data
+
+        # Callers get their own copy, leaving the memo intact
+        return data.copy()
+
+
+def tdist_plan(
+    sampleid=None,
+    database=None,
+    phenos=None,
+    tdist_filter=None,
+    rdist_filter=None,
+    all_reg=False,
+    excl_ln=False,
+    t_hist_step=50,
+    altdb=None,
+    t_hist_type=None,
+    area_engine="randomcell",
+):
+    """Source-only TdistPlan; add steps, or use .options(), then .collect().
+    Arguments as in tdistogram.
+    """
+
+    spec = FilterSpec(
+        sampleid,
+        phenos,
+        tdist_filter,
+        rdist_filter,
+        all_reg,
+        excl_ln,
+        t_hist_step=t_hist_step,
+        t_hist_type=t_hist_type,
+    )
+
+    return TdistPlan((spec, database, altdb, area_engine))
@@ -0,0 +1,111 @@
+"""complete_counts tests"""
+
+import numpy as np
+import pandas as pd
+from datafunks.expr_total import expr_total
+from datafunks.get_cell_counts import complete_counts
+
+KEYS = ["sampleid", "phenotype", "exprphenotype"]
+
+
+def _loop_complete_counts(cells, t_hist_step=None):
+    # The per-group loop complete_counts replaced, as a reference
+    if t_hist_step is None:
+        expr_list = cells["exprphenotype"].unique()
+        miss_list = []
+        for name, group in cells.groupby(["sampleid", "phenotype"]):
+            expr = group["exprphenotype"].values
+            missing = pd.DataFrame(
+                {"exprphenotype": [e for e in expr_list if e not in expr]}
+            )
+            missing["c"] = 0
+            missing["sampleid"] = name[0]
+            missing["phenotype"] = name[1]
+            miss_list.append(missing)
+        cells = pd.concat([cells, *miss_list])
+
+        return expr_total(cells, ["sampleid", "phenotype"])
+
+    tdist_total = cells["tdist_bin"].unique()
+    bins = np.arange(
+        tdist_total.min(), tdist_total.max() + t_hist_step, t_hist_step
+    )
+    miss_list = []
+    for name, group in cells.groupby(KEYS):
+        tdist = group["tdist_bin"].values
+        missing = pd.DataFrame(
+            {"tdist_bin": [int(b) for b in bins if b not in tdist]}
+        )
+        missing["c"] = 0
+        missing["sampleid"] = name[0]
+        missing["phenotype"] = name[1]
+        missing["exprphenotype"] = name[2]
+        miss_list.append(missing)
+    cells = pd.concat([cells, *miss_list]).reset_index(drop=True)
+    cells["tdist_bin"] = cells["tdist_bin"].astype(int)
+
+    return expr_total(cells, ["sampleid", "phenotype", "tdist_bin"])
+
+
+def _counts(seed, binned):
+    # Sparse random counts, so plenty of bins/exprphenotypes are missing
+    rng = np.random.default_rng(seed)
+    rows = [
+        (s, p, e, b, int(rng.integers(1, 100)))
+        for s in [1, 2, 5]
+        for p in ["CD8", "FoxP3", "CD163"]
+        for e in ["PD1+", "PD1-", "PDL1+"]
+        for b in (range(-100, 400, 50) if binned else [0])
+        if rng.random() < 0.4
+    ]
+    cells = pd.DataFrame(rows, columns=[*KEYS, "tdist_bin", "c"])
+
+    return cells if binned else cells.drop(columns="tdist_bin")
+
+
+def _sorted(df):
+    keys = [c for c in [*KEYS, "tdist_bin"] if c in df]
+
+    return df[[*keys, "c"]].sort_values(keys).reset_index(drop=True)
+
+
+def test_matches_loop_binned():
+    """binned zero-fill matches the per-group loop"""
+    for seed in range(5):
+        cells = _counts(seed, True)
+        pd.testing.assert_frame_equal(
+            _sorted(complete_counts(cells, 50)),
+            _sorted(_loop_complete_counts(cells, 50)),
+            check_dtype=False,
+        )
+
+
+def test_matches_loop_unbinned():
+    """unbinned exprphenotype fill matches the per-group loop"""
+    for seed in range(5):
+        cells = _counts(seed, False)
+        pd.testing.assert_frame_equal(
+            _sorted(complete_counts(cells)),
+            _sorted(_loop_complete_counts(cells)),
+            check_dtype=False,
+        )
+
+
+def test_every_group_gets_every_bin():
+    """each group spans the whole tdist range, with a Total per bin"""
+    cells = _counts(0, True)
+    filled = complete_counts(cells, 50)
+    n_bins = len(
+        range(cells["tdist_bin"].min(), cells["tdist_bin"].max() + 1, 50)
+    )
+
+    per_group = filled.groupby(KEYS)["tdist_bin"].nunique()
+    assert (per_group == n_bins).all()
+    totals = filled[filled["exprphenotype"] == "Total"]
+    assert totals["c"].sum() == cells["c"].sum()
+
+
+def test_empty():
+    """no counts comes back empty rather than failing"""
+    cells = _counts(0, True).iloc[:0]
+    assert complete_counts(cells, 50).empty
@@ -0,0 +1,35 @@
+"""cox_screen tests"""
+
+import numpy as np
+import pandas as pd
+from lifelines import CoxPHFitter
+from datafunks.cox_screen import cox_screen
+
+
+def _cohort(seed, n=80):
+    rng = np.random.default_rng(seed)
+    cohort = pd.DataFrame(
+        {
+            "os": rng.exponential(20, n),
+            "died": (rng.random(n) < 0.7).astype(int),
+            "duration": rng.normal(size=n),
+            "event": rng.normal(size=n),
+        }
+    )
+    cohort.loc[::11, "event"] = np.nan
+
+    return cohort
+
+
+def test_matches_lifelines():
+    """each row is lifelines' univariable fit, even for covariates named
+    like the internal outcome columns"""
+    cohort = _cohort(0)
+    res = cox_screen(cohort, ["duration", "event"], "os", "died")
+
+    for name in ["duration", "event"]:
+        data = cohort[[name, "os", "died"]].dropna()
+        cph = CoxPHFitter().fit(data, duration_col="os", event_col="died")
+        assert np.isclose(res.loc[name, "coef"], cph.summary["coef"][name])
+        assert np.isclose(res.loc[name, "p"], cph.summary["p"][name])
+        assert res.loc[name, "n"] == len(data)
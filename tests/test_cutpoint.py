@@ -0,0 +1,82 @@
+"""logrank_cutpoint tests"""
+
+import numpy as np
+import pandas as pd
+from lifelines.statistics import logrank_test
+from datafunks.cutpoint import logrank_cutpoint
+
+
+def _cohort(seed, n=80):
+    # Integer durations and features, so both have ties
+    rng = np.random.default_rng(seed)
+    x = rng.integers(0, 20, n).astype(float)
+    cohort = pd.DataFrame(
+        {
+            "x": x,
+            "duration": np.ceil(rng.exponential(20 + x, n)),
+            "event": (rng.random(n) < 0.7).astype(int),
+        }
+    )
+    cohort.loc[cohort.index[::9], "x"] = np.nan
+
+    return cohort
+
+
+def _chi2(cohort, cut):
+    # lifelines' log-rank statistic for High (x >= cut) vs Low
+    high = cohort["x"] >= cut
+    result = logrank_test(
+        cohort.loc[high, "duration"],
+        cohort.loc[~high, "duration"],
+        cohort.loc[high, "event"],
+        cohort.loc[~high, "event"],
+    )
+
+    return result.test_statistic
+
+
+def test_matches_lifelines_at_cut():
+    """chi2 and group sizes at the chosen cut match lifelines"""
+    for seed in range(5):
+        cohort = _cohort(seed)
+        row = logrank_cutpoint(cohort, "x", "duration", "event", n_perm=0)
+        row = row.iloc[0]
+
+        cohort = cohort[cohort["x"].notna()]
+        assert row["n_high"] == (cohort["x"] >= row["cutpoint"]).sum()
+        assert row["n_low"] == (cohort["x"] < row["cutpoint"]).sum()
+        assert np.isclose(row["chi2"], _chi2(cohort, row["cutpoint"]))
+
+
+def test_best_of_brute_force():
+    """the chosen cut is the best of every allowed cut, each scored by
+    lifelines"""
+    min_prop = 0.1
+    for seed in range(5):
+        cohort = _cohort(seed)
+        row = logrank_cutpoint(
+            cohort, "x", "duration", "event", min_prop, n_perm=0
+        ).iloc[0]
+
+        cohort = cohort[cohort["x"].notna()]
+        smallest = int(np.ceil(min_prop * len(cohort)))
+        vals = np.unique(cohort["x"])
+        best = 0
+        for lo, hi in zip(vals[:-1], vals[1:]):
+            cut = (lo + hi) / 2
+            n_high = (cohort["x"] >= cut).sum()
+            if smallest <= n_high <= len(cohort) - smallest:
+                best = max(best, _chi2(cohort, cut))
+
+        assert np.isclose(row["chi2"], best)
+
+
+def test_permutation_p():
+    """p_perm is reproducible with a seed and stays in (0, 1]"""
+    cohort = _cohort(0)
+    kwargs = {"n_perm": 200, "seed": 1}
+    first = logrank_cutpoint(cohort, "x", "duration", "event", **kwargs)
+    again = logrank_cutpoint(cohort, "x", "duration", "event", **kwargs)
+
+    pd.testing.assert_frame_equal(first, again)
+    assert 1 / 201 <= first["p_perm"][0] <= 1
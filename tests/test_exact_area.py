@@ -0,0 +1,42 @@
+"""Exact area tests, on polygons standing in for the annotations"""
+
+import numpy as np
+import shapely
+from datafunks import exact_area as ea
+from datafunks.filter_spec import FilterSpec
+
+
+def _cohort(sampleid, lnames, *_):
+    # Tumor disc in good tissue; sample 2 has no tumor
+    good = shapely.box(-2000, -2000, 2000, 2000)
+    tumor = shapely.Point(0, 0).buffer(600)
+    geoms = {
+        "good tissue": {s: good for s in sampleid},
+        "tumor": {s: tumor if s == 1 else None for s in sampleid},
+        "regression": {s: None for s in sampleid},
+        "lymph node": {s: None for s in sampleid},
+    }
+
+    return {ln: geoms[ln] for ln in lnames}
+
+
+def test_bins_cover_the_band(monkeypatch):
+    """binned areas are int bins adding up to the unbinned band, all from
+    one get_geometries call"""
+    calls = []
+
+    def get_geometries(*args):
+        calls.append(args)
+        return _cohort(*args)
+
+    monkeypatch.setattr(ea, "get_geometries", get_geometries)
+    spec = FilterSpec([1, 2], tdist_filter=(400, -400), t_hist_step=100)
+
+    binned = ea.exact_area(spec, "db")
+    total = ea.exact_area(spec.replace(t_hist_step=None), "db")
+
+    assert len(calls) == 2
+    assert binned["tdist_bin"].dtype.kind == "i"
+    assert list(binned["tdist_bin"]) == [-200, -100, 0, 100]
+    assert (binned["sampleid"] == 1).all()
+    assert np.isclose(binned["area_mm"].sum(), total["area_mm"][0])
@@ -0,0 +1,136 @@
+"""FilterSpec compilation tests"""
+
+from datafunks.dynamic_query import dynamic_sql
+from datafunks.filter_spec import FilterSpec, inline_params, param_sql
+
+
+def test_spec_normalizes_and_hashes():
+    """equal filters given differently compare and hash equal"""
+    a = FilterSpec([3, 1, 3], "CD8", tdist_filter=500)
+    b = FilterSpec((1, 3), ["CD8"], tdist_filter=(500.0, None))
+    assert a == b
+    assert hash(a) == hash(b)
+    assert a.sampleid == (1, 3)
+
+
+def test_compile_clauses_and_params():
+    """filters compile to aliased clauses with values kept as params"""
+    spec = FilterSpec(
+        [1, 2],
+        ["CD8", "FoxP3"],
+        tdist_filter=(500, 100),
+        rdist_filter=200,
+        all_reg=True,
+        excl_ln=True,
+        t_hist_step=50,
+    )
+    compiled = spec.compile(cell="c", reg="r", ln="ln", pheno="p")
+
+    assert set(compiled.clauses) == {
+        "sampleid",
+        "pheno",
+        "tdist",
+        "rdist",
+        "ln",
+    }
+    assert compiled.clauses["tdist"] == (
+        "((c.tdist <= @tdist_outer and c.tdist > @tdist_inner)"
+        " or c.rdist <= 0)"
+    )
+    assert compiled.clauses["rdist"] == "(c.rdist <= @rdist_outer)"
+    assert "c.sampleid in" in compiled.clauses["sampleid"]
+    assert compiled.params == {
+        "sampleids": "1,2",
+        "phenos": "CD8,FoxP3",
+        "tdist_outer": 500.0,
+        "tdist_inner": 100.0,
+        "rdist_outer": 200.0,
+        "t_step": 100,
+    }
+    assert compiled.bin_expr == "floor(c.tdist/@t_step)*@t_step/2"
+    assert compiled.bin_select == ", tb.tdist_bin"
+
+
+def test_compile_without_filters():
+    """an empty spec matches every row and needs no params"""
+    compiled = FilterSpec().compile()
+    assert compiled.where == "1 = 1"
+    assert compiled.params == {}
+    assert compiled.bin_apply == ""
+
+
+def test_compile_unqualified():
+    """qualify=False leaves sampleid and distance columns bare"""
+    spec = FilterSpec(1, tdist_filter=500, all_reg=True, t_hist_step=50)
+    compiled = spec.compile(qualify=False)
+    assert (
+        compiled.clauses["tdist"] == "((tdist <= @tdist_outer) or rdist <= 0)"
+    )
+    assert compiled.clauses["sampleid"].startswith("sampleid in")
+    assert compiled.bin_expr == "floor(tdist/@t_step)*@t_step/2"
+
+
+def test_dynamic_sql_snippets_are_bare():
+    """dynamic_sql inlines values into unaliased snippets"""
+    pheno_sql, tdist_sql, rdist_sql, ln_sql, t_hist_sql, group_sql = (
+        dynamic_sql(
+            phenos="CD8",
+            tdist_filter=(500, 100),
+            rdist_filter=(None, None),
+            excl_ln=True,
+            t_hist_step=50,
+        )
+    )
+    assert pheno_sql == "and p.phenotype in " + (
+        "(select value from string_split(N'CD8', ','))"
+    )
+    assert tdist_sql == "and (tdist <= 500.0 and tdist > 100.0)"
+    assert rdist_sql == ""
+    assert ln_sql == (
+        "and (ln.lname is NULL or ln.ganno.STContains(c.pos) = 0)"
+    )
+    assert t_hist_sql == "floor(tdist/100)*100/2 tdist_bin,"
+    assert group_sql == ", floor(tdist/100)*100/2"
+
+
+def test_param_sql():
+    """params are declared and passed to sp_executesql"""
+    sql = "select * from t where a = @a and b = 'x'"
+    params = {"a": 1, "s": "it's"}
+    assert param_sql(sql, params) == (
+        "exec sp_executesql N'select * from t where a = @a and b = ''x''', "
+        "N'@a int, @s nvarchar(max)', @a = 1, @s = N'it''s'"
+    )
+    assert (
+        inline_params(sql, params) == "select * from t where a = 1 and b = 'x'"
+    )
+    assert param_sql(sql, {}) == sql
+
+
+def test_empty_cohort():
+    """no sampleids compiles to a filter that matches nothing, rather than
+    casting '' (or a NULL sentinel) to int"""
+    compiled = FilterSpec([]).compile()
+    assert compiled.params["sampleids"] == ""
+    assert "where value <> ''" in compiled.clauses["sampleid"]
+
+
+def test_inner_only_bounds():
+    """an inner-only tdist/rdist bound is applied, not dropped as it was by
+    the old duplicated elif"""
+    spec = FilterSpec(tdist_filter=(None, 100), rdist_filter=(None, -50))
+    compiled = spec.compile(cell="c")
+    assert compiled.clauses["tdist"] == "(c.tdist > @tdist_inner)"
+    assert compiled.clauses["rdist"] == "(c.rdist > @rdist_inner)"
+    assert compiled.params == {"tdist_inner": 100.0, "rdist_inner": -50.0}
+
+    compiled = spec.replace(all_reg=True).compile(cell="c")
+    assert compiled.clauses["tdist"] == (
+        "((c.tdist > @tdist_inner) or c.rdist <= 0)"
+    )
+
+    _, tdist_sql, rdist_sql, _, _, _ = dynamic_sql(
+        tdist_filter=(None, 100), rdist_filter=(None, -50), all_reg=True
+    )
+    assert tdist_sql == "and ((tdist > 100.0) or rdist <= 0)"
+    assert rdist_sql == "and (rdist > -50.0)"
@@ -0,0 +1,147 @@
+"""HistCube rollup tests"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from datafunks.filter_spec import FilterSpec
+from datafunks.get_cell_counts import complete_counts
+from datafunks.get_density import NUR
+from datafunks.hist_cube import HistCube
+
+FINE_STEP = 10
+
+
+def _cells(n, seed, pheno=True):
+    # Random cells, in pixels. rdist avoids (0, fine) where the cube's
+    # snapped all_reg can't match rdist <= 0, but includes 0 itself
+    rng = np.random.default_rng(seed)
+    fine = 2 * FINE_STEP
+    rdist = np.where(
+        rng.random(n) < 0.4,
+        rng.uniform(-400, 0, n),
+        rng.uniform(fine, 800, n),
+    )
+    rdist[rng.random(n) < 0.05] = 0
+    cells = pd.DataFrame(
+        {
+            "sampleid": rng.choice([1, 2, 3], n),
+            "tdist": rng.uniform(-300, 1200, n),
+            "rdist": rdist,
+            "in_ln": (rng.random(n) < 0.1).astype(int),
+            "in_reg": (rng.random(n) < 0.3).astype(int),
+        }
+    )
+    if pheno:
+        cells["phenotype"] = rng.choice(["CD8", "FoxP3"], n)
+        cells["exprphenotype"] = rng.choice(["a", "b"], n)
+
+    return cells
+
+
+def _cube(cells, keys):
+    fine = 2 * FINE_STEP
+    cells = cells.assign(
+        tbin=np.floor(cells["tdist"] / fine),
+        rbin=np.floor(cells["rdist"] / fine),
+    )
+    keys = [*keys, "tbin", "rbin", "in_ln", "in_reg"]
+
+    return cells.groupby(keys).size().rename("c").reset_index()
+
+
+def _filter(cells, spec):
+    # The SQL filters, applied to the cells directly
+    keep = cells["sampleid"].isin(spec.sampleid)
+    if spec.phenos is not None and "phenotype" in cells:
+        keep &= cells["phenotype"].isin(spec.phenos)
+    outer, inner = spec.tdist_filter
+    band = pd.Series(True, index=cells.index)
+    if outer is not None:
+        band &= cells["tdist"] <= outer
+    if inner is not None:
+        band &= cells["tdist"] > inner
+    if spec.all_reg:
+        band |= cells["rdist"] <= 0
+    keep &= band
+    outer, inner = spec.rdist_filter
+    if outer is not None:
+        keep &= cells["rdist"] <= outer
+    if inner is not None:
+        keep &= cells["rdist"] > inner
+    if spec.excl_ln:
+        keep &= cells["in_ln"] == 0
+    if spec.reg_only:
+        keep &= cells["in_reg"] == 1
+
+    cells = cells[keep]
+    if spec.t_hist_step is not None:
+        step = 2 * spec.t_hist_step
+        cells = cells.assign(
+            tdist_bin=np.floor(cells["tdist"] / step) * step / 2
+        )
+
+    return cells
+
+
+SPECS = [
+    FilterSpec([1, 2, 3], t_hist_step=50),
+    FilterSpec([1, 3], "CD8", tdist_filter=(600, -100), t_hist_step=20),
+    FilterSpec([1, 2], tdist_filter=400, all_reg=True, t_hist_step=100),
+    FilterSpec(
+        [2, 3],
+        rdist_filter=(400, -100),
+        excl_ln=True,
+        reg_only=True,
+        t_hist_step=50,
+    ),
+    FilterSpec([1, 2, 3], tdist_filter=(500, 0), all_reg=True),
+]
+
+
+def test_cell_counts_rollup():
+    """cube counts match counting the filtered cells directly"""
+    cells = _cells(5000, 0)
+    keys = ["sampleid", "phenotype", "exprphenotype"]
+    cube = HistCube(_cube(cells, keys), _cube(_cells(10, 1, False), []), 10)
+
+    for spec in SPECS:
+        direct = _filter(cells, spec)
+        if spec.t_hist_step is not None:
+            keys_bin = [*keys, "tdist_bin"]
+        else:
+            keys_bin = keys
+        direct = direct.groupby(keys_bin).size().rename("c").reset_index()
+        expected = complete_counts(direct, spec.t_hist_step)
+
+        rolled = cube.cell_counts(spec)
+        pd.testing.assert_frame_equal(
+            rolled[expected.columns].reset_index(drop=True),
+            expected,
+            check_dtype=False,
+        )
+
+
+def test_cell_area_rollup():
+    """cube area matches randomcell rows per bin over NUR"""
+    area_cells = _cells(5000, 2, pheno=False)
+    counts = _cube(_cells(10, 3), ["sampleid", "phenotype", "exprphenotype"])
+    cube = HistCube(counts, _cube(area_cells, ["sampleid"]), 10)
+
+    for spec in SPECS:
+        direct = _filter(area_cells, spec)
+        keys = ["sampleid"]
+        if spec.t_hist_step is not None:
+            keys.append("tdist_bin")
+        expected = direct.groupby(keys).size().rename("c").reset_index()
+        expected["area_mm"] = expected.pop("c") / NUR
+
+        pd.testing.assert_frame_equal(
+            cube.cell_area(spec), expected, check_dtype=False
+        )
+
+
+def test_step_must_be_multiple_of_fine_bins():
+    """bins that split a fine bin are refused"""
+    cube = HistCube(_cube(_cells(10, 4), ["sampleid"]), None, 10)
+    with pytest.raises(ValueError):
+        cube.cell_area(t_hist_step=25)
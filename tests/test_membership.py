@@ -0,0 +1,71 @@
+"""Local membership tests"""
+
+import numpy as np
+import pandas as pd
+import shapely
+from datafunks.filter_spec import FilterSpec
+from datafunks.membership import membership_mask, tag_membership
+
+
+def _geoms():
+    # Sample 1: tumor box with regression and lymph node inside it
+    # Sample 2: tumor only, no regression or lymph node annotation
+    rows = [
+        (1, "tumor", shapely.box(0, 0, 10, 10)),
+        (1, "regression", shapely.box(0, 0, 4, 4)),
+        (1, "lymph node", shapely.box(6, 6, 10, 10)),
+        (2, "tumor", shapely.box(0, 0, 10, 10)),
+    ]
+
+    return pd.DataFrame(rows, columns=["sampleid", "lname", "geometry"])
+
+
+def _cells():
+    # Inside, on the boundary (excluded, as by STContains) and outside
+    return pd.DataFrame(
+        {
+            "sampleid": [1, 1, 1, 1, 1, 2, 2],
+            "px": [2, 8, 4, 10, 20, 2, 8],
+            "py": [2, 8, 2, 5, 20, 2, 8],
+            "tdist": [-50, -50, -50, 0, 100, -50, -50],
+        }
+    )
+
+
+def test_tag_membership():
+    """flags follow STContains: inside only, not on the boundary, and
+    never for a missing annotation"""
+    cells = tag_membership(_cells(), _geoms())
+
+    np.testing.assert_array_equal(
+        cells["in_tumor"], [True, True, True, False, False, True, True]
+    )
+    np.testing.assert_array_equal(
+        cells["in_reg"], [True, False, False, False, False, False, False]
+    )
+    np.testing.assert_array_equal(
+        cells["in_ln"], [False, True, False, False, False, False, False]
+    )
+
+
+def test_membership_mask():
+    """tdist band, all_reg, excl_ln and reg_only on the flags"""
+    cells = tag_membership(_cells(), _geoms())
+
+    spec = FilterSpec(tdist_filter=(0, -50))
+    np.testing.assert_array_equal(
+        membership_mask(cells, spec), [1, 1, 1, 1, 0, 1, 1]
+    )
+    np.testing.assert_array_equal(
+        membership_mask(cells, spec, inclusive=False), [0, 0, 0, 1, 0, 0, 0]
+    )
+
+    spec = FilterSpec(tdist_filter=(0, 0), all_reg=True, excl_ln=True)
+    np.testing.assert_array_equal(
+        membership_mask(cells, spec), [1, 0, 0, 1, 0, 0, 0]
+    )
+
+    spec = FilterSpec(reg_only=True)
+    np.testing.assert_array_equal(
+        membership_mask(cells, spec), [1, 0, 0, 0, 0, 0, 0]
+    )
@@ -0,0 +1,189 @@
+"""Query cache tests, against a temporary cache directory"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import pandas as pd
+import pytest
+from datafunks import query_cache
+from datafunks.query_cache import (
+    cached_file,
+    cached_files,
+    cached_query,
+    disable_cache,
+    enable_cache,
+    invalidate_cache,
+    on_invalidate,
+    store_file,
+    store_files,
+)
+
+pytest.importorskip("pyarrow")
+
+
+class _DB:
+    # Stands in for a pooled session, counting the queries that reach it
+    database = "testdb"
+
+    def __init__(self):
+        self.calls = 0
+
+    def query(self, sql):
+        self.calls += 1
+        return pd.DataFrame({"sql": [sql] * 3, "x": [1, 2, 3]})
+
+
+@pytest.fixture(name="cache")
+def fixture_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_cache, "_INVALIDATE_HOOKS", [])
+    enable_cache(str(tmp_path))
+    yield tmp_path
+    disable_cache()
+
+
+def _edit_index(path, **entries):
+    # Overwrite fields of index entries, e.g. to age them
+    with open(path / "index.json", encoding="utf-8") as f:
+        index = json.load(f)
+    for key, fields in entries.items():
+        index[key].update(fields)
+    with open(path / "index.json", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+
+def _index(path):
+    with open(path / "index.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _key(sql):
+    return query_cache._key(sql, "testdb", None)
+
+
+def _write(path, file):
+    full = path.joinpath(*file.split("/"))
+    full.parent.mkdir(parents=True, exist_ok=True)
+    full.write_bytes(b"data")
+
+
+def test_hit(cache):
+    """a repeated query is read back from disk"""
+    db = _DB()
+    first = cached_query(db, "select 1")
+    again = cached_query(db, "select   1")
+
+    assert db.calls == 1
+    pd.testing.assert_frame_equal(first, again)
+    assert (cache / f"{_key('select 1')}.parquet").exists()
+
+
+def test_ttl_expiry(cache):
+    """an entry older than the ttl is queried again"""
+    db = _DB()
+    cached_query(db, "select 1")
+    _edit_index(cache, **{_key("select 1"): {"created": 0}})
+
+    cached_query(db, "select 1")
+    assert db.calls == 2
+
+
+def test_lru_eviction(cache):
+    """over max_bytes, the least recently used entries go first; a hit
+    counts as a use"""
+    db = _DB()
+    cached_query(db, "select 1")
+    cached_query(db, "select 2")
+    size = _index(cache)[_key("select 1")]["bytes"]
+    _edit_index(
+        cache,
+        **{
+            _key("select 1"): {"accessed": 1},
+            _key("select 2"): {"accessed": 0},
+        },
+    )
+    enable_cache(str(cache), max_bytes=2.5 * size)
+
+    cached_query(db, "select 1")
+    cached_query(db, "select 3")
+
+    index = _index(cache)
+    assert set(index) == {_key("select 1"), _key("select 3")}
+    assert not (cache / f"{_key('select 2')}.parquet").exists()
+
+
+def test_invalidate_by_sample(cache):
+    """only entries that may cover the sample are dropped"""
+    db = _DB()
+    cached_query(db, "select 1", sampleids=[1, 2])
+    cached_query(db, "select 2", sampleids=[3])
+    cached_query(db, "select 3")
+
+    invalidate_cache("testdb", sampleid=1)
+
+    assert set(_index(cache)) == {_key("select 2")}
+
+
+def test_invalidate_kind(cache):
+    """kind= drops only stored files of that kind"""
+    db = _DB()
+    cached_query(db, "select 1")
+    _write(cache, "geoms/testdb/1_tumor.wkb")
+    store_file(
+        "geoms/testdb/1_tumor.wkb", "testdb", sampleids=[1], kind="geoms"
+    )
+    assert cached_file("geoms/testdb/1_tumor.wkb")
+
+    invalidate_cache(kind="geoms")
+
+    assert set(_index(cache)) == {_key("select 1")}
+    assert not cached_file("geoms/testdb/1_tumor.wkb")
+    assert not (cache / "geoms" / "testdb" / "1_tumor.wkb").exists()
+
+
+def test_invalidate_hooks(cache):
+    """hooks run on every invalidate_cache, even with the cache off"""
+    calls = []
+
+    def hook(database, sampleid):
+        calls.append((database, sampleid))
+
+    on_invalidate(hook)
+
+    invalidate_cache(_DB(), 3)
+    disable_cache()
+    invalidate_cache()
+
+    assert calls == [("testdb", 3), (None, None)]
+
+
+def _store_many(path, worker, n):
+    # One process's writes, each its own load-modify-save of the index
+    enable_cache(path)
+    for i in range(n):
+        file = f"files/{worker}_{i}.bin"
+        _write(Path(path), file)
+        store_file(file, "testdb")
+
+
+def test_processes_share_index(cache):
+    """concurrent writers in other processes don't lose index entries"""
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        list(pool.map(_store_many, [str(cache)] * 4, range(4), [25] * 4))
+
+    assert len(_index(cache)) == 100
+    assert not os.path.exists(cache / "index.json.lock")
+
+
+def test_store_files_batch(cache):
+    """a batch is indexed in one write, and checked in one read"""
+    files = {f"geoms/testdb/{s}_tumor.wkb": [s] for s in range(5)}
+    for file in files:
+        _write(cache, file)
+    store_files(files, "testdb", kind="geoms")
+
+    assert set(_index(cache)) == set(files)
+    assert cached_files([*files, "geoms/testdb/9_tumor.wkb"]) == set(files)
+
+    invalidate_cache(sampleid=[0, 1])
+    assert cached_files(files) == set(list(files)[2:])
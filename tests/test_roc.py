@@ -0,0 +1,142 @@
+"""ROC engine tests"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import percentileofscore
+from datafunks.roc_plotter import _roc_matrix, batch_roc, threshold_grabber
+
+
+def _slow_threshold_grabber(thresh_vals, true_labels):
+    # The O(n^2) threshold_grabber the sort-once version replaced: filter
+    # the frame again at every threshold
+    df = pd.DataFrame({"thresh_vals": thresh_vals, "true_labels": true_labels})
+    vals = sorted(df["thresh_vals"])
+    thresholds = sorted(
+        {
+            x - 1 if idx == 0 else (x + vals[idx - 1]) / 2
+            for idx, x in enumerate([*vals, max(vals) + 1])
+        }
+    )
+
+    fpr_list, tpr_list = [], []
+    for t in thresholds:
+        above = df["thresh_vals"] >= t
+        low = df["true_labels"] == "Low"
+        high = df["true_labels"] == "High"
+        fpr_list.append((above & low).sum() / low.sum())
+        tpr_list.append((above & high).sum() / high.sum())
+
+    return pd.DataFrame(
+        {
+            "fpr": fpr_list,
+            "tpr": tpr_list,
+            "Youden_idx": np.subtract(tpr_list, fpr_list),
+            "threshold": thresholds,
+            "quantile": [
+                percentileofscore(df["thresh_vals"], t, kind="rank")
+                for t in thresholds
+            ],
+        }
+    )
+
+
+def _trapezoid(x, y):
+    # Area under the ROC points, in either direction
+    x, y = np.asarray(x), np.asarray(y)
+
+    return abs(np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2))
+
+
+def _data(seed, n=60):
+    # Integer values so there are plenty of ties, within and across classes
+    rng = np.random.default_rng(seed)
+    vals = pd.Series(rng.integers(0, 15, n).astype(float))
+    labels = pd.Series(np.where(rng.random(n) < 0.4, "High", "Low"))
+    labels[:2] = ["High", "Low"]
+
+    return vals, labels
+
+
+def test_threshold_grabber_matches_loop():
+    """sort-once ROC points, Youden and quantiles match the slow version"""
+    for seed in range(10):
+        vals, labels = _data(seed)
+        fast = threshold_grabber(vals, vals, labels)
+        slow = _slow_threshold_grabber(vals, labels)
+
+        pd.testing.assert_frame_equal(fast[slow.columns], slow)
+        auc = _trapezoid(slow["fpr"], slow["tpr"])
+        assert fast["auc"][0] == round(auc, 3)
+
+
+def test_threshold_grabber_median_labels():
+    """without labels, outcome >= its median is High"""
+    vals, _ = _data(0)
+    outcome = pd.Series(np.arange(len(vals)))
+    labels = np.where(outcome >= outcome.median(), "High", "Low")
+
+    pd.testing.assert_frame_equal(
+        threshold_grabber(vals, outcome),
+        threshold_grabber(vals, outcome, pd.Series(labels)),
+    )
+
+
+def test_roc_matrix_matches_loop():
+    """row-wise auc, best Youden index and its cut match the slow version,
+    taking the highest threshold among tied Youden maxima"""
+    rows = [_data(seed) for seed in range(10)]
+    vals = np.array([v.to_numpy() for v, _ in rows])
+    high = np.array([(lab == "High").to_numpy() for _, lab in rows])
+
+    _, _, auc, youden, threshold = _roc_matrix(vals, high)
+
+    for i, (v, lab) in enumerate(rows):
+        slow = _slow_threshold_grabber(v, lab)
+        assert np.isclose(auc[i], _trapezoid(slow["fpr"], slow["tpr"]))
+        best = slow[np.isclose(slow["Youden_idx"], slow["Youden_idx"].max())]
+        assert np.isclose(youden[i], best["Youden_idx"].iloc[-1])
+        # Midpoints of tied values sit on the value itself; both cut alike
+        cut = best["threshold"].iloc[-1]
+        assert ((v >= threshold[i]) == (v >= cut)).all()
+
+
+def test_batch_roc_matches_threshold_grabber():
+    """each feature's auc matches threshold_grabber on that feature alone"""
+    rng = np.random.default_rng(0)
+    features = pd.DataFrame(
+        rng.integers(0, 20, (50, 4)).astype(float), columns=list("abcd")
+    )
+    features.iloc[::7, 1] = np.nan
+    labels = pd.Series(np.where(rng.random(50) < 0.5, "High", "Low"))
+
+    ranking = batch_roc(features, true_labels=labels).set_index("feature")
+    for col in features:
+        keep = features[col].notna()
+        thresh_df = threshold_grabber(
+            features.loc[keep, col], labels[keep], labels[keep]
+        )
+        assert round(ranking.loc[col, "auc"], 3) == thresh_df["auc"][0]
+        assert ranking.loc[col, "n_high"] == (labels[keep] == "High").sum()
+
+
+def test_batch_roc_positional_labels():
+    """array labels go by position whatever the features' index; Series
+    labels align by index"""
+    rng = np.random.default_rng(1)
+    features = pd.DataFrame(
+        rng.integers(0, 20, (30, 3)).astype(float),
+        columns=list("abc"),
+        index=rng.permutation(np.arange(100, 130)),
+    )
+    labels = np.where(rng.random(30) < 0.5, "High", "Low")
+
+    by_position = batch_roc(features, true_labels=labels)
+    by_index = batch_roc(
+        features, true_labels=pd.Series(labels, index=features.index)[::-1]
+    )
+
+    pd.testing.assert_frame_equal(by_position, by_index)
+    assert by_position["auc"].notna().all()
+    with pytest.raises(ValueError):
+        batch_roc(features, true_labels=labels[:-1])